@@ -0,0 +1,230 @@
+'''
+benchmarks for the functions of recommendations.py on synthetic ratings
+the ratings follow a power law: a few items get most of the ratings and a few
+users give most of them, like in MovieLens. every function is timed on a
+sample of users at every size, the latency percentiles, the peak memory and
+the sizes are written out as JSON so that runs of different versions can be
+compared.
+usage: python benchmark.py --users 100,1000,5000 --items 2000 --density 0.01 --output run.json
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+import annindex
+import recommendations
+import ratingstore
+
+try:
+	import tracemalloc
+except ImportError:  # python 2, the resident size of a forked child is measured instead
+	tracemalloc = None
+	import resource
+
+# half star ratings between 1 and 5
+RATINGS = np.arange(2, 11) / 2.0
+
+
+def syntheticPrefs(users, items, density, alpha=1.0, seed=None):
+	'''
+	users x items ratings where about density of the cells are rated
+	the popularity of the items and the activity of the users both fall off as rank ** -alpha
+	'''
+	rng = np.random.RandomState(seed)
+
+	popularity = np.arange(1, items + 1) ** -float(alpha)
+	popularity /= popularity.sum()
+	activity = np.arange(1, users + 1) ** -float(alpha)
+	activity = rng.permutation(activity / activity.sum())
+
+	counts = np.clip(np.round(activity * density * users * items), 1, items).astype(int)
+	prefs = {}
+	for user in range(users):
+		rated = rng.choice(items, size=counts[user], replace=False, p=popularity)
+		ratings = rng.choice(RATINGS, size=counts[user])
+		prefs['user%d' % user] = dict(('item%d' % item, float(rating)) for item, rating in zip(rated, ratings))
+	return prefs
+
+
+def quiet(function, *args, **kwargs):
+	'''
+	calls function with its progress output sent to stderr so that it doesn't mix with the report
+	'''
+	stdout = sys.stdout
+	sys.stdout = sys.stderr
+	try:
+		return function(*args, **kwargs)
+	finally:
+		sys.stdout = stdout
+
+
+def percentiles(latencies):
+	latencies = np.array(latencies) * 1000.0
+	return {
+		'calls': len(latencies),
+		'mean_ms': float(latencies.mean()),
+		'p50_ms': float(np.percentile(latencies, 50)),
+		'p90_ms': float(np.percentile(latencies, 90)),
+		'p99_ms': float(np.percentile(latencies, 99)),
+		'max_ms': float(latencies.max())
+	}
+
+
+def forkedPeak(call):
+	'''
+	how much the resident size grows while call runs, in bytes
+	call runs in a forked child, which starts from the current resident size of
+	this process, so the high-water mark of the calls measured before doesn't carry over
+	'''
+	read, write = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		try:
+			os.close(read)
+			before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+			call()
+			after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+			os.write(write, str(after - before).encode('ascii'))
+		finally:
+			os._exit(0)
+
+	os.close(write)
+	try:
+		growth = os.read(read, 64)
+	finally:
+		os.close(read)
+		os.waitpid(pid, 0)
+	if not growth:
+		raise RuntimeError('the measured call failed in the forked child')
+	return int(growth) * 1024
+
+
+def peakMemory(call):
+	'''
+	the peak memory in bytes allocated while call runs
+	on python 2 this is the growth of the resident size of a forked child running call instead
+	'''
+	if tracemalloc is None:
+		return forkedPeak(call)
+
+	tracemalloc.start()
+	try:
+		call()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+
+def measure(calls):
+	'''
+	times every call and measures the memory of the first one
+	'''
+	latencies = []
+	for call in calls:
+		start = time.time()
+		call()
+		latencies.append(time.time() - start)
+
+	result = percentiles(latencies)
+	result['peak_bytes'] = peakMemory(calls[0])
+	return result
+
+
+def benchmarkPrefs(prefs, queries=20, n=10, seed=None, store=False):
+	'''
+	the measurements of every function for one set of ratings
+	store -> also measure the RatingStore versions of topMatches and getRecommendations,
+	and topMatches with an annindex.RandomProjectionIndex
+	'''
+	rng = random.Random(seed)
+	users = sorted(prefs)
+	sample = [rng.choice(users) for i in range(queries)]
+	pairs = [(rng.choice(users), rng.choice(users)) for i in range(queries)]
+
+	results = {}
+	results['sim_pearson'] = measure([lambda p=p: recommendations.sim_pearson(prefs, p[0], p[1]) for p in pairs])
+	results['topMatches'] = measure([lambda u=u: recommendations.topMatches(prefs, u, n) for u in sample])
+	results['getRecommendations'] = measure([lambda u=u: recommendations.getRecommendations(prefs, u, n=n)
+		for u in sample])
+
+	# runs twice, once timed and once for the memory
+	tables = []
+	results['calculateSimilarItems'] = measure([lambda: tables.append(quiet(recommendations.calculateSimilarItems, prefs, n=n))])
+	itemsMatch = tables[0]
+	results['getRecommendedItems'] = measure([lambda u=u: recommendations.getRecommendedItems(prefs, itemsMatch, u, n)
+		for u in sample])
+
+	if store:
+		start = time.time()
+		compiled = ratingstore.RatingStore.fromprefs(prefs)
+		results['RatingStore.fromprefs'] = percentiles([time.time() - start])
+		results['topMatches[store]'] = measure([lambda u=u: recommendations.topMatches(compiled, u, n)
+			for u in sample])
+		results['getRecommendations[store]'] = measure([lambda u=u: recommendations.getRecommendations(compiled, u, n=n)
+			for u in sample])
+
+		# the approximate topMatches with its recall of the exact matches
+		index = annindex.RandomProjectionIndex(compiled, seed=seed)
+		results['topMatches[ann]'] = measure([lambda u=u: recommendations.topMatches(compiled, u, n, ann=index)
+			for u in sample])
+		results['topMatches[ann]']['recall'] = annindex.recallAtK(compiled, index, n, users=sample)['recall']
+
+	return results
+
+
+def run(sizes, items, density, alpha=1.0, queries=20, n=10, seed=0, store=False):
+	'''
+	benchmarks every number of users in sizes and returns the report
+	'''
+	report = {
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'platform': platform.platform(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'parameters': {'items': items, 'density': density, 'alpha': alpha, 'queries': queries, 'n': n, 'seed': seed},
+		'results': []
+	}
+
+	for users in sizes:
+		prefs = syntheticPrefs(users, items, density, alpha, seed)
+		report['results'].append({
+			'users': users,
+			'items': len(set(item for ratings in prefs.values() for item in ratings)),
+			'ratings': sum([len(ratings) for ratings in prefs.values()]),
+			'functions': benchmarkPrefs(prefs, queries, n, seed, store)
+		})
+	return report
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='benchmarks recommendations.py on synthetic ratings')
+	parser.add_argument('--users', default='100,500,1000', help='comma separated numbers of users, one run each')
+	parser.add_argument('--items', type=int, default=1000)
+	parser.add_argument('--density', type=float, default=0.02, help='share of the users x items cells rated')
+	parser.add_argument('--alpha', type=float, default=1.0, help='exponent of the power law')
+	parser.add_argument('--queries', type=int, default=20, help='calls timed per function')
+	parser.add_argument('--n', type=int, default=10, help='size of the rankings')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--store', action='store_true', help='also time the RatingStore paths')
+	parser.add_argument('--output', help='file for the JSON report, standard output when left out')
+	args = parser.parse_args(argv)
+
+	sizes = [int(size) for size in args.users.split(',')]
+	report = run(sizes, args.items, args.density, args.alpha, args.queries, args.n, args.seed, args.store)
+
+	text = json.dumps(report, indent=2, sort_keys=True)
+	if args.output:
+		with open(args.output, 'w') as out:
+			out.write(text + '\n')
+	else:
+		sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+	main()
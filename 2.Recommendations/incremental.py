@@ -0,0 +1,243 @@
+'''
+keeps the similarity tables of recommendations.calculateSimilarItems and
+calculateSimilarUsers up to date while new ratings arrive instead of
+recomputing them from scratch
+for every pair of items rated by the same user the number of shared raters
+and the sum of the squared rating differences are kept, which is all that
+sim_distance needs. a new rating only changes the pairs between the rated
+item and the other items of the same user, so only those rows are ranked again.
+the users are handled the same way, with the sums sim_pearson needs as well,
+and a new rating only changes the pairs between its user and the other raters
+of its item.
+'''
+import heapq
+from math import sqrt
+
+from recommendations import sim_distance, sim_pearson, topScores
+
+
+def rankPartners(name, partners, similarity, names, n):
+	'''
+	the n names most similar to name in the order of topMatches
+	partners -> the names sharing something with name, scored by similarity(partner)
+	names -> every name, the ones sharing nothing score 0 and are ordered by name
+	'''
+	top = heapq.nlargest(n, ((similarity(other), other) for other in partners))
+
+	if len(top) < n or top[-1][0] <= 0:
+		# the unrelated names can outrank partners scoring 0 or less
+		unrelated = ((0, other) for other in names if other != name and other not in partners)
+		top = heapq.nlargest(n, top + heapq.nlargest(n, unrelated))
+	return top
+
+
+def reachesUnrelated(ranking, n):
+	'''
+	true when the ranking includes names scoring 0, a new name could take their place
+	'''
+	return len(ranking) < n or ranking[-1][0] <= 0
+
+
+class ItemSimilarityIndex(object):
+	def __init__(self, prefs, n=10):
+		'''
+		prefs -> the nested dict of users and their ratings, it is updated in place by add_rating
+		n -> the number of similar items kept for each item
+		itemsMatch holds the same table as calculateSimilarItems(prefs, n) and can be
+		passed straight to getRecommendedItems
+		'''
+		self.prefs = prefs
+		self.n = n
+
+		# pairs[item1][item2] is the [count, sum of squared differences] of the two items,
+		# both directions share the same list
+		self.pairs = {}
+		for user in prefs:
+			ratings = list(prefs[user].items())
+			for item, rating in ratings:
+				self.pairs.setdefault(item, {})
+			for i in range(len(ratings)):
+				item1, rating1 = ratings[i]
+				for item2, rating2 in ratings[i + 1:]:
+					stats = self.pairs[item1].get(item2)
+					if stats is None:
+						stats = self.pairs[item1][item2] = self.pairs[item2][item1] = [0, 0]
+					stats[0] += 1
+					stats[1] += pow(rating1 - rating2, 2)
+
+		self.itemsMatch = dict((item, self.rankItem(item)) for item in self.pairs)
+
+	def similarity(self, item1, item2):
+		'''
+		the sim_distance score of the two items from the kept sums
+		'''
+		stats = self.pairs[item1].get(item2)
+		if stats is None or stats[0] == 0:
+			return 0
+		return 1.0 / (1 + sqrt(max(stats[1], 0)))
+
+	def rankItem(self, item):
+		'''
+		the n items most similar to item in the order of topMatches
+		'''
+		return rankPartners(item, self.pairs[item], lambda other: self.similarity(item, other), self.pairs, self.n)
+
+	def add_rating(self, user, item, rating):
+		'''
+		records a new rating, or a changed one, and updates the affected rows of itemsMatch
+		'''
+		ratings = self.prefs.setdefault(user, {})
+		old = ratings.get(item)
+		newitem = item not in self.pairs
+		self.pairs.setdefault(item, {})
+
+		for other, otherrating in ratings.items():
+			if other == item:
+				continue
+			stats = self.pairs[item].get(other)
+			if stats is None:
+				stats = self.pairs[item][other] = self.pairs[other][item] = [0, 0]
+			if old is None:
+				stats[0] += 1
+			else:
+				stats[1] -= pow(old - otherrating, 2)
+			stats[1] += pow(rating - otherrating, 2)
+
+		ratings[item] = rating
+
+		changed = set(ratings)
+		if newitem:
+			# a new item can enter the rows that reach the unrelated items
+			changed.update(other for other in self.itemsMatch if reachesUnrelated(self.itemsMatch[other], self.n))
+		for other in changed:
+			self.itemsMatch[other] = self.rankItem(other)
+
+
+class UserNeighbourIndex(object):
+	def __init__(self, prefs, n=5, similarity=sim_distance):
+		'''
+		prefs -> the nested dict of users and their ratings, it is updated in place by add_rating
+		n -> the number of neighbours kept for each user
+		similarity -> sim_distance or sim_pearson
+		neighbours holds the same table as calculateSimilarUsers(prefs, n), which uses sim_distance
+		'''
+		if similarity not in (sim_distance, sim_pearson):
+			raise ValueError('only sim_distance and sim_pearson can be kept up to date')
+		self.prefs = prefs
+		self.n = n
+		self.pearson = similarity is sim_pearson
+
+		self.order = {}  # user -> the position deciding which side of a pair the user is
+		self.raters = {}  # item -> the users who rated it
+		# pairs[user1][user2] is shared by both directions and holds the sums over the shared items:
+		# [count, sum1, sum2, sum1Sq, sum2Sq, sumProd, sum of squared differences]
+		# where 1 is the user that came first in order
+		self.pairs = {}
+
+		for user in prefs:
+			self.addUser(user)
+			for item in prefs[user]:
+				self.raters.setdefault(item, []).append(user)
+
+		for item, raters in self.raters.items():
+			for i in range(len(raters)):
+				for other in raters[i + 1:]:
+					self.addToPair(raters[i], prefs[raters[i]][item], other, prefs[other][item], 1)
+
+		self.neighbours = dict((user, self.rankUser(user)) for user in prefs)
+
+	def addUser(self, user):
+		if user not in self.order:
+			self.order[user] = len(self.order)
+			self.pairs[user] = {}
+
+	def addToPair(self, user, rating, other, otherrating, sign):
+		'''
+		adds (sign 1) or removes (sign -1) one shared item from the sums of the pair
+		'''
+		stats = self.pairs[user].get(other)
+		if stats is None:
+			stats = self.pairs[user][other] = self.pairs[other][user] = [0, 0, 0, 0, 0, 0, 0]
+		if self.order[user] > self.order[other]:
+			rating, otherrating = otherrating, rating
+
+		stats[0] += sign
+		stats[1] += sign * rating
+		stats[2] += sign * otherrating
+		stats[3] += sign * pow(rating, 2)
+		stats[4] += sign * pow(otherrating, 2)
+		stats[5] += sign * rating * otherrating
+		stats[6] += sign * pow(rating - otherrating, 2)
+
+	def similarity(self, user, other):
+		'''
+		the sim_distance or sim_pearson score of the two users from the kept sums
+		'''
+		stats = self.pairs[user].get(other)
+		if stats is None or stats[0] == 0:
+			return 0
+		if not self.pearson:
+			return 1.0 / (1 + sqrt(max(stats[6], 0)))
+
+		n, sum1, sum2, sum1Sq, sum2Sq, sumProd = stats[:6]
+		numerator = sumProd - sum1 * sum2 / n
+		denomenator = sqrt(max((sum1Sq - sum1 * sum1 / n) * (sum2Sq - sum2 * sum2 / n), 0))
+		if denomenator == 0:
+			return 0
+		return numerator / denomenator
+
+	def rankUser(self, user):
+		'''
+		the n users most similar to user in the order of topMatches
+		'''
+		return rankPartners(user, self.pairs[user], lambda other: self.similarity(user, other), self.prefs, self.n)
+
+	def add_rating(self, user, item, rating):
+		'''
+		records a new rating, or a changed one, and updates the neighbours of user
+		and of the other raters of item
+		'''
+		newuser = user not in self.order
+		self.addUser(user)
+		ratings = self.prefs.setdefault(user, {})
+		old = ratings.get(item)
+		raters = self.raters.setdefault(item, [])
+
+		for other in raters:
+			if other == user:
+				continue
+			if old is not None:
+				self.addToPair(user, old, other, self.prefs[other][item], -1)
+			self.addToPair(user, rating, other, self.prefs[other][item], 1)
+
+		ratings[item] = rating
+		if old is None:
+			raters.append(user)
+
+		changed = set(raters)
+		if newuser:
+			# a new user can enter the rows that reach the unrelated users
+			changed.update(other for other in self.neighbours if reachesUnrelated(self.neighbours[other], self.n))
+		for other in changed:
+			self.neighbours[other] = self.rankUser(other)
+
+	def getRecommendations(self, person, n=None):
+		'''
+		recommendations.getRecommendations for person from the kept similarities,
+		only the users sharing items with person are visited
+		'''
+		sim_sums = {}
+		product_sums = {}
+
+		for other in self.pairs[person]:
+			sim = self.similarity(person, other)
+			if sim <= 0:
+				continue
+
+			for item, rating in self.prefs[other].items():
+				if self.prefs[person].get(item):
+					continue
+				sim_sums[item] = sim_sums.get(item, 0) + sim
+				product_sums[item] = product_sums.get(item, 0) + rating * sim
+
+		return topScores(((total / sim_sums[item], item) for item, total in product_sums.items()), n)
@@ -0,0 +1,148 @@
+'''
+latent factor recommendations with alternating least squares
+every user and every item gets a vector of factors so that the mean rating
+plus the dot product of the two vectors approximates the rating. with the
+item factors fixed, the best user factors are a small regularized least
+squares problem per user, and the other way round, so the two sides are
+solved in turns. the users (or items) are solved a block at a time with
+batched numpy solves, and the blocks can run on several threads as numpy
+releases the GIL while solving.
+serving a user is one product of the item factors with the user's vector,
+which doesn't depend on the number of users at all.
+'''
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import ratingstore
+
+
+def solveBlock(target, fixed, store, rows, mean, regularization, chunksize):
+	'''
+	the least squares factors of the given rows of store written into target
+	fixed holds the factors of the other side, rows without ratings are left as they are
+	the products of the factors are summed chunksize ratings at a time, so a row
+	with a great many ratings doesn't need them all at once
+	'''
+	local, ids, ratings = ratingstore.gatherrows(store, rows)
+	counts = np.bincount(local, minlength=len(rows))
+	rated = counts > 0
+	if not rated.any():
+		return
+
+	# the position of every rating's row among the rated rows
+	slots = (np.cumsum(rated) - 1)[local]
+	gram = np.zeros((int(rated.sum()), fixed.shape[1], fixed.shape[1]))
+	rhs = np.zeros((int(rated.sum()), fixed.shape[1]))
+	for start in range(0, len(ids), chunksize):
+		chunk = slots[start:start + chunksize]
+		vectors = fixed[ids[start:start + chunksize]]
+		starts = np.flatnonzero(np.concatenate(([True], chunk[1:] != chunk[:-1])))
+		gram[chunk[starts]] += np.add.reduceat(vectors[:, :, None] * vectors[:, None, :], starts, axis=0)
+		rhs[chunk[starts]] += np.add.reduceat(vectors * (ratings[start:start + chunksize] - mean)[:, None], starts,
+			axis=0)
+	gram += regularization * counts[rated][:, None, None] * np.eye(fixed.shape[1])
+
+	target[rows[rated]] = np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+
+
+class MatrixFactorization(object):
+	def __init__(self, factors=10, regularization=0.1, iterations=10, workers=1, blocksize=65536, seed=None):
+		'''
+		factors -> the length of the user and item vectors
+		regularization -> keeps the vectors small, scaled by the number of ratings of each row
+		iterations -> the number of user then item solves
+		workers -> threads solving blocks at the same time
+		blocksize -> about how many ratings the users or items solved together in one batched
+		solve have, which bounds the memory of a block at blocksize * factors * factors floats
+		'''
+		self.factors = factors
+		self.regularization = regularization
+		self.iterations = iterations
+		self.workers = workers
+		self.blocksize = blocksize
+		self.random = np.random.RandomState(seed)
+
+		self.store = None
+		self.userfactors = None
+		self.itemfactors = None
+		self.mean = 0.0
+		self.history = []  # the root mean squared error on the ratings after every iteration
+
+	def initialFactors(self, names, oldnames, oldfactors):
+		'''
+		small random vectors, except for the names that already had factors when warm starting
+		'''
+		factors = self.random.normal(scale=0.1, size=(len(names), self.factors))
+		if oldfactors is not None:
+			oldindex = dict((name, i) for i, name in enumerate(oldnames))
+			for i, name in enumerate(names):
+				if name in oldindex:
+					factors[i] = oldfactors[oldindex[name]]
+		return factors
+
+	def solve(self, target, fixed, store):
+		blocks = [np.arange(start, end) for start, end in ratingstore.rowchunks(store.indptr, self.blocksize)]
+
+		if self.workers == 1:
+			for rows in blocks:
+				solveBlock(target, fixed, store, rows, self.mean, self.regularization, self.blocksize)
+			return
+
+		with ThreadPoolExecutor(max_workers=self.workers) as executor:
+			futures = [executor.submit(solveBlock, target, fixed, store, rows, self.mean, self.regularization,
+				self.blocksize) for rows in blocks]
+			for future in futures:
+				future.result()
+
+	def fit(self, prefs, warm_start=False):
+		'''
+		trains the factors on prefs, the nested dict or a ratingstore.RatingStore
+		warm_start -> start from the factors of the last fit for the users and items
+		it already knew, so a retrain on new ratings needs fewer iterations
+		'''
+		if isinstance(prefs, ratingstore.RatingStore):
+			store = prefs
+		else:
+			store = ratingstore.RatingStore.fromprefs(prefs)
+		# the item side of the same ratings
+		itemstore = ratingstore.RatingStore(store.items, store.users, store.colptr, store.colrows, store.colvals)
+
+		if warm_start and self.store is not None:
+			userfactors = self.initialFactors(store.users, self.store.users, self.userfactors)
+			itemfactors = self.initialFactors(store.items, self.store.items, self.itemfactors)
+		else:
+			userfactors = self.initialFactors(store.users, None, None)
+			itemfactors = self.initialFactors(store.items, None, None)
+
+		self.mean = float(store.values.mean()) if len(store.values) else 0.0
+		self.history = []
+		for iteration in range(self.iterations):
+			self.solve(userfactors, itemfactors, store)
+			self.solve(itemfactors, userfactors, itemstore)
+
+			predicted = self.mean + (userfactors[store.rowof] * itemfactors[store.indices]).sum(axis=1)
+			self.history.append(float(np.sqrt(np.mean((predicted - store.values) ** 2))))
+
+		self.store = store
+		self.userfactors = userfactors
+		self.itemfactors = itemfactors
+		return self
+
+	def predict(self, user, item):
+		'''
+		the predicted rating of user for item
+		'''
+		u = self.store.userindex[user]
+		i = self.store.itemindex[item]
+		return self.mean + float(self.userfactors[u].dot(self.itemfactors[i]))
+
+	def recommend(self, user, n=10):
+		'''
+		the n items with the highest predicted ratings that user hasn't rated,
+		as (score, item) pairs like recommendations.getRecommendations
+		'''
+		scores = self.mean + self.itemfactors.dot(self.userfactors[self.store.userindex[user]])
+		candidates = np.ones(len(scores), dtype=bool)
+		candidates[self.store.row(user)[0]] = False
+		return ratingstore.topscores(scores, np.flatnonzero(candidates), self.store.items, n)
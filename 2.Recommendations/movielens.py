@@ -0,0 +1,166 @@
+'''
+bulk loader for the MovieLens ratings
+the ratings file is read in large chunks that numpy parses at once, the user
+and movie ids are mapped to dense integer indices and every title is stored
+once per movie instead of once per rating. the supported layouts are
+	ml-100k               -> u.data (tab separated) and u.item (| separated)
+	ml-1m, ml-10m         -> ratings.dat and movies.dat (:: separated)
+	ml-20m, ml-latest     -> ratings.csv and movies.csv (with a header line)
+usage: python movielens.py <data directory>  prints the rows/sec of the loaders
+'''
+import csv
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+import ratingstore
+
+# every layout is: ratings file, delimiter, header lines, movies file, delimiter, encoding of the titles
+LAYOUTS = [
+	('ratings.csv', b',', 1, 'movies.csv', b',', 'utf-8'),
+	('ratings.dat', b'::', 0, 'movies.dat', b'::', 'latin-1'),
+	('u.data', b'\t', 0, 'u.item', b'|', 'latin-1')
+]
+
+
+def findLayout(path):
+	for layout in LAYOUTS:
+		if os.path.exists(os.path.join(path, layout[0])):
+			return layout
+	raise IOError('no MovieLens ratings file in %s' % path)
+
+
+def decodeTitle(raw, encoding):
+	if bytes is str:  # python 2 keeps the titles as str like loadMovieLens
+		return raw
+	return raw.decode(encoding)
+
+
+def readRatings(filename, delimiter, header=0, chunkbytes=1 << 24):
+	'''
+	parses the ratings file into an (n, 4) array of user, movie, rating, timestamp
+	about chunkbytes of lines are turned into numbers by one numpy call
+	'''
+	chunks = []
+	with open(filename, 'rb') as f:
+		for i in range(header):
+			f.readline()
+		while True:
+			lines = f.readlines(chunkbytes)
+			if not lines:
+				break
+			text = b''.join(lines).replace(delimiter, b' ')
+			chunks.append(np.fromstring(text, sep=' ').reshape(-1, 4))
+
+	if not chunks:
+		return np.zeros((0, 4))
+	return np.concatenate(chunks)
+
+
+def readTitles(filename, delimiter, encoding):
+	'''
+	maps the movie ids to their titles
+	'''
+	titles = {}
+	if filename.endswith('.csv'):
+		# the titles are quoted when they contain commas
+		if bytes is str:
+			f = open(filename, 'rb')
+		else:
+			f = io.open(filename, encoding=encoding, newline='')
+		with f:
+			rows = csv.reader(f)
+			next(rows)
+			for row in rows:
+				titles[int(row[0])] = row[1]
+		return titles
+
+	with open(filename, 'rb') as f:
+		for line in f:
+			movie_id, title = line.split(delimiter)[0:2]
+			titles[int(movie_id)] = decodeTitle(title, encoding)
+	return titles
+
+
+class MovieLensData(object):
+	'''
+	the ratings as integer indexed arrays
+	users -> the MovieLens user ids, user index i is users[i]
+	items -> the MovieLens movie ids, item index j is items[j]
+	titles -> titles[j] is the title of items[j]
+	values -> the ratings
+	with csr the ratings of user i are values[indptr[i]:indptr[i+1]] for the items
+	indices[indptr[i]:indptr[i+1]], otherwise rows and cols hold the indices of every rating
+	'''
+	def __init__(self, users, items, titles, values, rows=None, cols=None, indptr=None, indices=None):
+		self.users = users
+		self.items = items
+		self.titles = titles
+		self.values = values
+		self.rows = rows
+		self.cols = cols
+		self.indptr = indptr
+		self.indices = indices
+
+	def tostore(self):
+		'''
+		a ratingstore.RatingStore named like the prefs of loadMovieLens
+		'''
+		if self.indptr is None:
+			raise ValueError('load the ratings with csr=True to build a store')
+		return ratingstore.RatingStore([str(user) for user in self.users], self.titles,
+			self.indptr, self.indices, self.values)
+
+
+def loadMovieLensArrays(path, csr=True, chunkbytes=1 << 24):
+	'''
+	loads the ratings found in the directory path into a MovieLensData
+	csr -> sort the ratings by user and build indptr/indices, otherwise keep
+	the file order in rows/cols
+	'''
+	ratingsfile, delimiter, header, moviesfile, moviesdelimiter, encoding = findLayout(path)
+
+	ratings = readRatings(os.path.join(path, ratingsfile), delimiter, header, chunkbytes)
+	users, rows = np.unique(ratings[:, 0].astype(np.int64), return_inverse=True)
+	items, cols = np.unique(ratings[:, 1].astype(np.int64), return_inverse=True)
+	values = ratings[:, 2].copy()
+	del ratings
+
+	titles = readTitles(os.path.join(path, moviesfile), moviesdelimiter, encoding)
+	titles = [titles.get(movie_id, str(movie_id)) for movie_id in items.tolist()]
+
+	if not csr:
+		return MovieLensData(users, items, titles, values, rows=rows, cols=cols)
+
+	order = np.argsort(rows, kind='mergesort')
+	indptr = np.zeros(len(users) + 1, dtype=np.int64)
+	np.cumsum(np.bincount(rows, minlength=len(users)), out=indptr[1:])
+	return MovieLensData(users, items, titles, values[order], indptr=indptr, indices=cols[order])
+
+
+def benchmark(path, repeat=3):
+	'''
+	prints the rows/sec of loadMovieLensArrays and, for ml-100k, of recommendations.loadMovieLens
+	'''
+	from recommendations import loadMovieLens
+
+	loaders = [('loadMovieLensArrays', lambda: len(loadMovieLensArrays(path).values))]
+	if findLayout(path)[0] == 'u.data':
+		loaders.append(('loadMovieLens', lambda: sum([len(r) for r in loadMovieLens(path).values()])))
+
+	for name, loader in loaders:
+		best = None
+		for i in range(repeat):
+			start = time.time()
+			rows = loader()
+			elapsed = time.time() - start
+			if best is None or elapsed < best:
+				best = elapsed
+		print('%s: %d rows in %.3fs, %.0f rows/sec' % (name, rows, best, rows / best))
+
+
+if __name__ == '__main__':
+	benchmark(sys.argv[1])
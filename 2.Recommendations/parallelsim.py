@@ -0,0 +1,74 @@
+'''
+builds the item similarity table of recommendations.calculateSimilarItems
+on a pool of processes
+the transposed preferences are compiled into a ratingstore.RatingStore and
+written to a temporary directory once. the workers memory map it read only
+instead of receiving a pickled copy of itemPrefs, and every worker computes
+the similar items for a chunk of the items.
+'''
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import ratingstore
+from recommendations import transformPrefs
+
+# the stores already mapped by this process, keyed by their directory
+mapped_stores = {}
+
+
+def similarItemsChunk(directory, start, end, n):
+	'''
+	runs in a worker, finds the n most similar items of the items start to end
+	'''
+	if directory not in mapped_stores:
+		mapped_stores[directory] = ratingstore.RatingStore.load(directory)
+	itemstore = mapped_stores[directory]
+
+	return [(item, ratingstore.topmatches(itemstore, item, n, ratingstore.sim_distance_all))
+		for item in itemstore.users[start:end]]
+
+
+def calculateSimilarItems(prefs, n=10, workers=None, chunksize=256, progress=None):
+	'''
+	same table as recommendations.calculateSimilarItems
+	workers -> the number of processes, the number of cpus when None and no pool at all when 1
+	chunksize -> the number of items sent to a worker at a time
+	progress -> called as progress(done, total) whenever a chunk of items is complete
+	'''
+	itemstore = ratingstore.RatingStore.fromprefs(transformPrefs(prefs))
+	total = len(itemstore.users)
+	chunks = [(start, min(start + chunksize, total)) for start in range(0, total, chunksize)]
+
+	results = {}
+	done = 0
+
+	if workers == 1:
+		mapped_stores[None] = itemstore
+		try:
+			for start, end in chunks:
+				results.update(similarItemsChunk(None, start, end, n))
+				done += end - start
+				if progress is not None:
+					progress(done, total)
+		finally:
+			del mapped_stores[None]
+		return results
+
+	directory = tempfile.mkdtemp(prefix='similaritems')
+	try:
+		itemstore.save(directory)
+		del itemstore
+
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			futures = dict((executor.submit(similarItemsChunk, directory, start, end, n), end - start)
+				for start, end in chunks)
+			for future in as_completed(futures):
+				results.update(future.result())
+				done += futures[future]
+				if progress is not None:
+					progress(done, total)
+	finally:
+		shutil.rmtree(directory, ignore_errors=True)
+
+	return results  # each item will have its n most similar items
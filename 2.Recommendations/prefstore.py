@@ -0,0 +1,198 @@
+'''
+a compact replacement for the nested prefs dict
+user and item names are interned to integer ids once. every user keeps two
+arrays, the ids of the rated items in sorted order and the ratings as 32 bit
+floats, and every item keeps the sorted ids of its raters. a rating is stored
+once: the item orientation looks it up in the arrays of the user.
+PrefStore and its transpose behave like the nested dicts (store[user][item],
+iteration, get, items, len), so every function of recommendations.py takes
+them in place of prefs and of transformPrefs(prefs).
+ratings are kept as float32, which is exact for the usual half star ratings.
+'''
+from array import array
+from bisect import bisect_left
+
+try:
+	from collections.abc import Mapping
+except ImportError:  # python 2
+	from collections import Mapping
+
+
+def find(ids, target):
+	'''
+	the position of target in the sorted array ids, -1 when it is missing
+	'''
+	pos = bisect_left(ids, target)
+	if pos < len(ids) and ids[pos] == target:
+		return pos
+	return -1
+
+
+class UserRatings(Mapping):
+	'''
+	item -> rating view of one user
+	'''
+	def __init__(self, store, user):
+		self.store = store
+		self.user = user
+
+	def __getitem__(self, item):
+		itemid = self.store.itemindex.get(item)
+		if itemid is not None:
+			pos = find(self.store.useritems[self.user], itemid)
+			if pos >= 0:
+				return self.store.userratings[self.user][pos]
+		raise KeyError(item)
+
+	def __contains__(self, item):
+		itemid = self.store.itemindex.get(item)
+		return itemid is not None and find(self.store.useritems[self.user], itemid) >= 0
+
+	def __iter__(self):
+		names = self.store.items
+		return (names[itemid] for itemid in self.store.useritems[self.user])
+
+	def __len__(self):
+		return len(self.store.useritems[self.user])
+
+	def items(self):
+		names = self.store.items
+		return [(names[itemid], rating) for itemid, rating in
+			zip(self.store.useritems[self.user], self.store.userratings[self.user])]
+
+
+class ItemRatings(Mapping):
+	'''
+	user -> rating view of one item, the ratings are read from the arrays of the users
+	'''
+	def __init__(self, store, item):
+		self.store = store
+		self.item = item
+
+	def rating(self, user):
+		pos = find(self.store.useritems[user], self.item)
+		if pos < 0:
+			return None
+		return self.store.userratings[user][pos]
+
+	def __getitem__(self, user):
+		userid = self.store.userindex.get(user)
+		if userid is not None:
+			rating = self.rating(userid)
+			if rating is not None:
+				return rating
+		raise KeyError(user)
+
+	def __contains__(self, user):
+		userid = self.store.userindex.get(user)
+		return userid is not None and find(self.store.itemusers[self.item], userid) >= 0
+
+	def __iter__(self):
+		names = self.store.users
+		return (names[userid] for userid in self.store.itemusers[self.item])
+
+	def __len__(self):
+		return len(self.store.itemusers[self.item])
+
+	def items(self):
+		names = self.store.users
+		return [(names[userid], self.rating(userid)) for userid in self.store.itemusers[self.item]]
+
+
+class PrefStore(Mapping):
+	def __init__(self, prefs=None):
+		'''
+		prefs -> the nested dict of users and their ratings to start from
+		'''
+		self.users = []
+		self.userindex = {}
+		self.items = []
+		self.itemindex = {}
+		self.useritems = []  # sorted array('i') of item ids per user
+		self.userratings = []  # array('f') of ratings per user, in the order of useritems
+		self.itemusers = []  # sorted array('i') of user ids per item
+
+		if prefs is not None:
+			for user in prefs:
+				userid = self.internUser(user)
+				rated = sorted((self.internItem(item), rating) for item, rating in prefs[user].items())
+				self.useritems[userid] = array('i', [itemid for itemid, rating in rated])
+				self.userratings[userid] = array('f', [rating for itemid, rating in rated])
+				for itemid, rating in rated:
+					self.itemusers[itemid].append(userid)  # user ids only grow, so this stays sorted
+
+	def internUser(self, user):
+		userid = self.userindex.get(user)
+		if userid is None:
+			userid = self.userindex[user] = len(self.users)
+			self.users.append(user)
+			self.useritems.append(array('i'))
+			self.userratings.append(array('f'))
+		return userid
+
+	def internItem(self, item):
+		itemid = self.itemindex.get(item)
+		if itemid is None:
+			itemid = self.itemindex[item] = len(self.items)
+			self.items.append(item)
+			self.itemusers.append(array('i'))
+		return itemid
+
+	def addRating(self, user, item, rating):
+		'''
+		records a new rating, or replaces the rating user gave to item
+		'''
+		userid = self.internUser(user)
+		itemid = self.internItem(item)
+
+		itemids = self.useritems[userid]
+		pos = bisect_left(itemids, itemid)
+		if pos < len(itemids) and itemids[pos] == itemid:
+			self.userratings[userid][pos] = rating
+			return
+
+		itemids.insert(pos, itemid)
+		self.userratings[userid].insert(pos, rating)
+		raters = self.itemusers[itemid]
+		raters.insert(bisect_left(raters, userid), userid)
+
+	def transpose(self):
+		'''
+		the item -> user -> rating view of the same arrays, like transformPrefs
+		'''
+		return TransposedPrefStore(self)
+
+	def __getitem__(self, user):
+		return UserRatings(self, self.userindex[user])
+
+	def __contains__(self, user):
+		return user in self.userindex
+
+	def __iter__(self):
+		return iter(self.users)
+
+	def __len__(self):
+		return len(self.users)
+
+
+class TransposedPrefStore(Mapping):
+	'''
+	item -> user -> rating view of a PrefStore
+	'''
+	def __init__(self, store):
+		self.store = store
+
+	def transpose(self):
+		return self.store
+
+	def __getitem__(self, item):
+		return ItemRatings(self.store, self.store.itemindex[item])
+
+	def __contains__(self, item):
+		return item in self.store.itemindex
+
+	def __iter__(self):
+		return iter(self.store.items)
+
+	def __len__(self):
+		return len(self.store.items)
@@ -0,0 +1,529 @@
+'''
+a compiled store for the ratings used in recommendations.py
+the nested prefs dict is turned into CSR arrays (one row per user) with the
+user and item names interned to integer ids. an item oriented copy of the
+arrays (CSC) is kept as well so that the users sharing items with a person
+can be found without walking every user.
+'''
+import heapq
+import os
+from itertools import islice
+import pickle
+import numpy as np
+
+# bytes of the arrays kept for a block of users by the batch recommendations, sizes
+# the block when no blocksize is given
+BLOCKBYTES = 256 << 20
+
+
+class RatingStore(object):
+	# the arrays written by save and memory mapped by load
+	arrays = ('indptr', 'indices', 'values', 'rowof', 'colptr', 'colrows', 'colvals')
+
+	def __init__(self, users, items, indptr, indices, values):
+		'''
+		users -> the names of the rows, users[i] owns row i
+		items -> the names of the columns
+		indptr, indices, values -> the ratings of user i are values[indptr[i]:indptr[i+1]]
+		and were given to the items indices[indptr[i]:indptr[i+1]]
+		'''
+		self.setnames(users, items)
+
+		self.indptr = np.asarray(indptr, dtype=np.int64)
+		self.indices = np.asarray(indices, dtype=np.int64)
+		self.values = np.asarray(values, dtype=np.float64)
+
+		# the row of every rating
+		self.rowof = np.repeat(np.arange(len(self.users)), np.diff(self.indptr))
+
+		# the item oriented view, a stable sort keeps the raters of an item in row order
+		order = np.argsort(self.indices, kind='mergesort')
+		self.colptr = np.zeros(len(self.items) + 1, dtype=np.int64)
+		np.cumsum(np.bincount(self.indices, minlength=len(self.items)), out=self.colptr[1:])
+		self.colrows = self.rowof[order]
+		self.colvals = self.values[order]
+
+	def setnames(self, users, items):
+		self.users = list(users)
+		self.items = list(items)
+		self.userindex = dict((user, i) for i, user in enumerate(self.users))
+		self.itemindex = dict((item, i) for i, item in enumerate(self.items))
+		self.rowdicts = {}  # the rows already compiled for the mapping interface
+		self.prefsdict = None
+
+	def save(self, directory):
+		'''
+		writes the arrays as .npy files and the names as a pickle into directory
+		so that other processes can memory map the store with load
+		'''
+		for name in self.arrays:
+			np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+		with open(os.path.join(directory, 'names.pkl'), 'wb') as f:
+			pickle.dump((self.users, self.items), f, pickle.HIGHEST_PROTOCOL)
+
+	@classmethod
+	def load(cls, directory, mmap_mode='r'):
+		'''
+		reads a store written by save, the arrays are memory mapped read only
+		by default so the page cache is shared by every process loading them
+		'''
+		store = cls.__new__(cls)
+		with open(os.path.join(directory, 'names.pkl'), 'rb') as f:
+			store.setnames(*pickle.load(f))
+		for name in cls.arrays:
+			setattr(store, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode))
+		return store
+
+	@classmethod
+	def fromprefs(cls, prefs):
+		'''
+		compiles the nested prefs dict, users and their items keep the order
+		in which prefs yields them
+		'''
+		users = []
+		items = []
+		itemindex = {}
+		indptr = [0]
+		indices = []
+		values = []
+
+		for user in prefs:
+			users.append(user)
+			for item, rating in prefs[user].items():
+				if item not in itemindex:
+					itemindex[item] = len(items)
+					items.append(item)
+				indices.append(itemindex[item])
+				values.append(rating)
+			indptr.append(len(indices))
+
+		return cls(users, items, indptr, indices, values)
+
+	def row(self, user):
+		'''
+		the item ids and the ratings of a user
+		'''
+		u = self.userindex[user]
+		start, end = self.indptr[u], self.indptr[u + 1]
+		return self.indices[start:end], self.values[start:end]
+
+	# the mapping interface lets the scalar similarity functions run on the store,
+	# every row is compiled into a dict the first time it is asked for and kept,
+	# so the lookups cost the same as on prefs. the dicts are shared, don't modify them
+	def __getitem__(self, user):
+		try:
+			return self.rowdicts[user]
+		except KeyError:
+			itemids, ratings = self.row(user)
+			ratings = self.rowdicts[user] = dict(zip([self.items[i] for i in itemids.tolist()], ratings.tolist()))
+			return ratings
+
+	def asdict(self):
+		'''
+		the nested prefs dict of the whole store, compiled once and kept, for the
+		similarities that have no batched version and look up ratings one at a time
+		'''
+		if self.prefsdict is None:
+			self.prefsdict = dict((user, self[user]) for user in self.users)
+		return self.prefsdict
+
+	def __iter__(self):
+		return iter(self.users)
+
+	def __len__(self):
+		return len(self.users)
+
+	def __contains__(self, user):
+		return user in self.userindex
+
+
+def segments(ptr, ids):
+	'''
+	the positions of the entries ptr[i]:ptr[i+1] of every i in ids one after the
+	other, and the number of entries of each i
+	'''
+	starts = ptr[ids]
+	counts = ptr[ids + 1] - starts
+	offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+	return offsets + np.arange(counts.sum()), counts
+
+
+def sharedratings(store, person):
+	'''
+	finds every rating given by any user to an item that person has rated
+	returns the rows of the raters, the ratings of person and the ratings of the raters
+	the ratings are grouped by the items of person in the order person rated them
+	'''
+	itemids, ratings = store.row(person)
+	positions, counts = segments(store.colptr, itemids)
+
+	return store.colrows[positions], np.repeat(ratings, counts), store.colvals[positions]
+
+
+def sharedratingsamong(store, person, ids):
+	'''
+	like sharedratings for the users ids only, their rows are gathered instead of the
+	raters of every item of person, so the work depends on the rows of ids alone
+	returns the positions in ids of the raters, the ratings of person and the ratings of the raters
+	'''
+	itemids, ratings = store.row(person)
+	# the position of every item in the row of person, -1 for the items person didn't rate
+	positions = np.full(len(store.items), -1, dtype=np.int64)
+	positions[itemids] = np.arange(len(itemids))
+
+	local, theiritems, theirs = gatherrows(store, ids)
+	found = positions[theiritems]
+	shared = found >= 0
+	return local[shared], ratings[found[shared]], theirs[shared]
+
+
+def distancescores(rows, mine, theirs, size, min_overlap):
+	'''
+	the euclidean distance scores from the shared ratings of sharedratings, for size rows
+	'''
+	n = np.bincount(rows, minlength=size)
+	sum_squared_diffs = np.bincount(rows, weights=(mine - theirs) ** 2, minlength=size)
+
+	scores = 1.0 / (1 + np.sqrt(sum_squared_diffs))
+	scores[n < max(min_overlap, 1)] = 0
+	return scores
+
+
+def pearsonscores(rows, mine, theirs, size, min_overlap):
+	'''
+	the pearson correlations from the shared ratings of sharedratings, for size rows
+	'''
+	n = np.bincount(rows, minlength=size)
+	sum1 = np.bincount(rows, weights=mine, minlength=size)
+	sum2 = np.bincount(rows, weights=theirs, minlength=size)
+	sum1Sq = np.bincount(rows, weights=mine ** 2, minlength=size)
+	sum2Sq = np.bincount(rows, weights=theirs ** 2, minlength=size)
+	sumProd = np.bincount(rows, weights=mine * theirs, minlength=size)
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		numerator = sumProd - sum1 * sum2 / n
+		denomenator = np.sqrt((sum1Sq - sum1 * sum1 / n) * (sum2Sq - sum2 * sum2 / n))
+		scores = numerator / denomenator
+
+	# no shared items, a zero denomenator or rounding below zero inside the root
+	scores[(n < max(min_overlap, 1)) | ~(denomenator != 0) | np.isnan(scores)] = 0
+	return scores
+
+
+def sim_distance_all(store, person, min_overlap=1):
+	'''
+	the euclidean distance score of person against every user in one pass
+	same values as recommendations.sim_distance
+	users sharing fewer than min_overlap items with person score 0
+	'''
+	rows, mine, theirs = sharedratings(store, person)
+	return distancescores(rows, mine, theirs, len(store.users), min_overlap)
+
+
+def sim_pearson_all(store, person, min_overlap=1):
+	'''
+	the pearson correlation of person against every user in one pass
+	same values as recommendations.sim_pearson
+	users sharing fewer than min_overlap items with person score 0
+	'''
+	rows, mine, theirs = sharedratings(store, person)
+	return pearsonscores(rows, mine, theirs, len(store.users), min_overlap)
+
+
+def sim_distance_among(store, person, ids, min_overlap=1):
+	'''
+	the euclidean distance scores of person against the users ids (row ids), in the order of ids
+	'''
+	rows, mine, theirs = sharedratingsamong(store, person, ids)
+	return distancescores(rows, mine, theirs, len(ids), min_overlap)
+
+
+def sim_pearson_among(store, person, ids, min_overlap=1):
+	'''
+	the pearson correlations of person against the users ids (row ids), in the order of ids
+	'''
+	rows, mine, theirs = sharedratingsamong(store, person, ids)
+	return pearsonscores(rows, mine, theirs, len(ids), min_overlap)
+
+
+def topscores(scores, ids, names, n=None):
+	'''
+	the (score, name) pairs of the n highest scores among ids in descending order
+	argpartition narrows the candidates down to the scores not below the nth
+	largest so that the ties at the cut are still broken by the name
+	'''
+	scores = scores[ids]
+	if n is not None and n < len(ids):
+		if n <= 0:
+			return []
+		cut = np.partition(scores, len(scores) - n)[len(scores) - n]
+		keep = scores >= cut
+		ids, scores = ids[keep], scores[keep]
+
+	pairs = [(float(score), names[i]) for i, score in zip(ids, scores)]
+	if n is None:
+		return sorted(pairs, reverse=True)
+	return heapq.nlargest(n, pairs)
+
+
+def topmatches(store, person, n, similarity_all):
+	'''
+	the n users most similar to person, same ranking as recommendations.topMatches
+	'''
+	scores = similarity_all(store, person)
+	others = np.arange(len(store.users))
+	others = others[others != store.userindex[person]]
+
+	return topscores(scores, others, store.users, n)
+
+
+def candidaterows(store, ann, person):
+	'''
+	the row ids of the candidates an annindex index finds for person, person left out
+	an index built on this store hands out its row ids, the names are looked up otherwise
+	'''
+	if getattr(ann, 'users', None) is store.users:
+		ids = ann.candidateids(person)
+	else:
+		ids = np.array([store.userindex[other] for other in ann.candidates(person)], dtype=np.int64)
+	return ids[ids != store.userindex[person]]
+
+
+def topmatchesamong(store, person, ids, n, similarity_among):
+	'''
+	the n users among the row ids most similar to person, only their rows are scored
+	'''
+	scores = np.zeros(len(store.users))
+	scores[ids] = similarity_among(store, person, ids)
+	return topscores(scores, ids, store.users, n)
+
+
+def recommendations(store, person, similarity_all, n=None, min_overlap=1):
+	'''
+	weighted average of the ratings of the users positively similar to person,
+	same ranking as recommendations.getRecommendations
+	'''
+	scores = similarity_all(store, person, min_overlap)
+	scores[store.userindex[person]] = 0  # a person can't recommend him/herself
+
+	weights = np.where(scores > 0, scores, 0)[store.rowof]
+	keep = weights > 0
+	itemids = store.indices[keep]
+	weights = weights[keep]
+	nitems = len(store.items)
+
+	sim_sums = np.bincount(itemids, weights=weights, minlength=nitems)
+	product_sums = np.bincount(itemids, weights=store.values[keep] * weights, minlength=nitems)
+
+	candidates = np.bincount(itemids, minlength=nitems) > 0
+	# items already rated by person are not recommended
+	rated, ratings = store.row(person)
+	candidates[rated[ratings != 0]] = False
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		recoms = product_sums / sim_sums
+
+	return topscores(recoms, np.flatnonzero(candidates), store.items, n)
+
+
+def rowchunks(indptr, size):
+	'''
+	splits the rows into runs of whole rows holding about size ratings each
+	'''
+	start = 0
+	nrows = len(indptr) - 1
+	while start < nrows:
+		end = int(np.searchsorted(indptr, indptr[start] + size, side='right')) - 1
+		end = min(max(end, start + 1), nrows)
+		yield start, end
+		start = end
+
+
+def gatherrows(store, rows):
+	'''
+	the ratings of the given rows as (position in rows, item id, rating) arrays
+	'''
+	positions, counts = segments(store.indptr, rows)
+	return np.repeat(np.arange(len(rows)), counts), store.indices[positions], store.values[positions]
+
+
+def densify(store, rows, columns=None, width=None):
+	'''
+	the ratings of the given rows as a dense matrix and a matrix of ones where a rating exists
+	columns -> maps the item ids to the dense columns, -1 leaves an item out
+	'''
+	local, itemids, values = gatherrows(store, rows)
+	if columns is None:
+		width = len(store.items)
+	else:
+		itemids = columns[itemids]
+		keep = itemids >= 0
+		local, itemids, values = local[keep], itemids[keep], values[keep]
+
+	ratings = np.zeros((len(rows), width))
+	mask = np.zeros((len(rows), width))
+	ratings[local, itemids] = values
+	mask[local, itemids] = 1
+	return ratings, mask
+
+
+def blockstatistics(store, block, chunksize):
+	'''
+	yields every chunk of users with the sums over the items each user of block shares
+	with each user of the chunk: n, sum1, sum2, sum1Sq, sum2Sq, sumProd as block x chunk matrices
+	only the items rated in block take part, the other items can't be shared
+	'''
+	used = np.unique(gatherrows(store, block)[1])
+	columns = np.full(len(store.items), -1, dtype=np.int64)
+	columns[used] = np.arange(len(used))
+
+	ratings, mask = densify(store, block, columns, len(used))
+	squares = ratings ** 2
+	nusers = len(store.users)
+	for start in range(0, nusers, chunksize):
+		chunk = np.arange(start, min(start + chunksize, nusers))
+		other, othermask = densify(store, chunk, columns, len(used))
+		yield chunk, (mask.dot(othermask.T), ratings.dot(othermask.T), mask.dot(other.T),
+			squares.dot(othermask.T), mask.dot((other ** 2).T), ratings.dot(other.T))
+
+
+def sim_distance_block(store, block, chunksize=256):
+	'''
+	the euclidean distance scores of the users in block (row ids) against every user
+	'''
+	scores = np.zeros((len(block), len(store.users)))
+	for chunk, (n, sum1, sum2, sum1Sq, sum2Sq, sumProd) in blockstatistics(store, block, chunksize):
+		sum_squared_diffs = np.maximum(sum1Sq + sum2Sq - 2 * sumProd, 0)
+		scores[:, chunk] = np.where(n > 0, 1.0 / (1 + np.sqrt(sum_squared_diffs)), 0)
+	return scores
+
+
+def sim_pearson_block(store, block, chunksize=256):
+	'''
+	the pearson correlations of the users in block (row ids) against every user
+	'''
+	scores = np.zeros((len(block), len(store.users)))
+	for chunk, (n, sum1, sum2, sum1Sq, sum2Sq, sumProd) in blockstatistics(store, block, chunksize):
+		with np.errstate(divide='ignore', invalid='ignore'):
+			numerator = sumProd - sum1 * sum2 / n
+			variance1 = sum1Sq - sum1 * sum1 / n
+			variance2 = sum2Sq - sum2 * sum2 / n
+			# the sums are added in another order than in sim_pearson, a variance that is 0
+			# there must not turn into rounding noise here
+			variance1[variance1 <= 1e-12 * sum1Sq] = 0
+			variance2[variance2 <= 1e-12 * sum2Sq] = 0
+			denomenator = np.sqrt(variance1 * variance2)
+			block_scores = numerator / denomenator
+		block_scores[(n == 0) | (denomenator == 0) | np.isnan(block_scores)] = 0
+		scores[:, chunk] = block_scores
+	return scores
+
+
+def blockrows(rowbytes, blockbytes):
+	'''
+	the rows of rowbytes bytes each fitting in blockbytes, at least one
+	'''
+	return max(1, int(blockbytes // max(1, rowbytes)))
+
+
+def batches(names, size):
+	names = iter(names)
+	while True:
+		batch = list(islice(names, size))
+		if not batch:
+			return
+		yield batch
+
+
+def recommendationsbatch(store, users, similarity_block, n=None, blocksize=None, chunksize=256,
+		blockbytes=BLOCKBYTES):
+	'''
+	yields (user, recommendations) for every user like recommendations.getRecommendations
+	the users are taken blocksize at a time, the similarities of a whole block against
+	every user and the weighted sums of the ratings are matrix products over chunks
+	of chunksize users. a block keeps its similarities to every user and its sums over
+	every item, about 8 * blocksize * (users + 7 * items) bytes, so by default blocksize
+	is as many users as fit in blockbytes
+	'''
+	nusers = len(store.users)
+	nitems = len(store.items)
+	if blocksize is None:
+		blocksize = blockrows(8 * (nusers + 7 * nitems + 6 * chunksize), blockbytes)
+
+	for names in batches(users, blocksize):
+		block = np.array([store.userindex[name] for name in names], dtype=np.int64)
+		weights = similarity_block(store, block, chunksize)
+		weights[np.arange(len(block)), block] = 0  # a person can't recommend him/herself
+		weights[weights < 0] = 0
+
+		sim_sums = np.zeros((len(block), nitems))
+		product_sums = np.zeros((len(block), nitems))
+		raters = np.zeros((len(block), nitems))
+		for start in range(0, nusers, chunksize):
+			end = min(start + chunksize, nusers)
+			chunkweights = weights[:, start:end]
+			if not chunkweights.any():
+				continue
+			ratings, mask = densify(store, np.arange(start, end))
+			sim_sums += chunkweights.dot(mask)
+			product_sums += chunkweights.dot(ratings)
+			raters += (chunkweights > 0).dot(mask)
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			recoms = product_sums / sim_sums
+
+		for b, name in enumerate(names):
+			candidates = raters[b] > 0
+			rated, ratings = store.row(name)
+			candidates[rated[ratings != 0]] = False
+			yield name, topscores(recoms[b], np.flatnonzero(candidates), store.items, n)
+
+
+def recommendeditemsbatch(store, itemsMatch, users, n=None, blocksize=None, blockbytes=BLOCKBYTES):
+	'''
+	yields (user, recommendations) for every user like recommendations.getRecommendedItems
+	the item similarity table is turned into CSR arrays once and the scores of a whole
+	block of users are summed with one bincount. a block keeps a few arrays over every
+	item, about 40 * blocksize * items bytes plus the neighbours of the items it rated,
+	so by default blocksize is as many users as fit in blockbytes
+	'''
+	names = list(store.items)
+	index = dict(store.itemindex)
+	ptr = [0]
+	neighbours = []
+	similarities = []
+	for item in store.items:
+		for similarity, other in (itemsMatch[item] if item in itemsMatch else ()):
+			if other not in index:
+				index[other] = len(names)
+				names.append(other)
+			neighbours.append(index[other])
+			similarities.append(similarity)
+		ptr.append(len(neighbours))
+	ptr = np.array(ptr, dtype=np.int64)
+	neighbours = np.array(neighbours, dtype=np.int64)
+	similarities = np.array(similarities, dtype=np.float64)
+	width = len(names)
+	if blocksize is None:
+		blocksize = blockrows(40 * width, blockbytes)
+
+	for batch in batches(users, blocksize):
+		block = np.array([store.userindex[name] for name in batch], dtype=np.int64)
+		local, itemids, ratings = gatherrows(store, block)
+		positions, counts = segments(ptr, itemids)
+
+		cells = np.repeat(local, counts) * width + neighbours[positions]
+		weights = similarities[positions]
+		size = len(block) * width
+		totals = np.bincount(cells, weights=weights, minlength=size).reshape(len(block), width)
+		scores = np.bincount(cells, weights=weights * np.repeat(ratings, counts), minlength=size).reshape(len(block), width)
+		candidates = np.bincount(cells, minlength=size).reshape(len(block), width) > 0
+		# items already rated by the user are not recommended
+		candidates[local, itemids] = False
+		candidates &= totals != 0
+
+		with np.errstate(divide='ignore', invalid='ignore'):
+			recoms = scores / totals
+
+		for b, name in enumerate(batch):
+			yield name, topscores(recoms[b], np.flatnonzero(candidates[b]), names, n)
@@ -0,0 +1,157 @@
+'''
+a cache for the results of getRecommendations and getRecommendedItems
+the results are kept in least recently used order, optionally with a time to
+live, and are dropped as soon as a rating they depend on changes:
+	user based results of person depend on the ratings of person and of the users
+	sharing items with person. a rating of another user for an item person rated
+	can make that user a new neighbour, so it drops the result too
+	item based results of user depend on the ratings of user
+ratings have to go through RecommendationCache.addRating for this to work
+the results are kept as tuples and every call gets a list of its own, so a
+caller changing its list doesn't change what later calls get
+'''
+import time
+from collections import OrderedDict
+
+from recommendations import (getRecommendations, getRecommendedItems, sim_pearson,
+	buildRaterIndex, addRating, getNeighbours)
+
+
+class RecommendationCache(object):
+	def __init__(self, prefs, maxsize=10000, ttl=None, raterIndex=None):
+		'''
+		prefs -> the nested dict of ratings, addRating updates it in place
+		maxsize -> the number of results kept, the least recently used one is evicted first
+		ttl -> seconds after which a result is computed again, None to keep it until invalidated
+		raterIndex -> the index from buildRaterIndex, built from prefs when None
+		'''
+		self.prefs = prefs
+		self.raterIndex = raterIndex if raterIndex is not None else buildRaterIndex(prefs)
+		self.maxsize = maxsize
+		self.ttl = ttl
+
+		self.entries = OrderedDict()  # key -> (expiry time, result, item similarity table)
+		self.dependents = {}  # user -> keys of the results that use the ratings of user
+		self.userkeys = {}  # person -> keys of the user based results of person
+		self.dependencies = {}  # key -> users whose ratings the result uses
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+		self.invalidations = 0
+
+	def stats(self):
+		'''
+		the counters for monitoring
+		'''
+		return {
+			'size': len(self.entries),
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions,
+			'expirations': self.expirations,
+			'invalidations': self.invalidations
+		}
+
+	def lookup(self, key):
+		entry = self.entries.get(key)
+		if entry is not None and entry[0] is not None and entry[0] < time.time():
+			self.drop(key)
+			self.expirations += 1
+			entry = None
+
+		if entry is None:
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		# moves the key to the most recently used end
+		del self.entries[key]
+		self.entries[key] = entry
+		return entry
+
+	def store(self, key, result, users, itemsMatch=None):
+		expiry = time.time() + self.ttl if self.ttl is not None else None
+		self.entries[key] = (expiry, result, itemsMatch)
+		self.dependencies[key] = users
+		for user in users:
+			self.dependents.setdefault(user, set()).add(key)
+		if key[0] == 'user':
+			self.userkeys.setdefault(key[1], set()).add(key)
+
+		while len(self.entries) > self.maxsize:
+			oldest = next(iter(self.entries))
+			self.drop(oldest)
+			self.evictions += 1
+
+	def drop(self, key):
+		del self.entries[key]
+		for user in self.dependencies.pop(key):
+			keys = self.dependents.get(user)
+			if keys is not None:
+				keys.discard(key)
+				if not keys:
+					del self.dependents[user]
+		if key[0] == 'user':
+			keys = self.userkeys[key[1]]
+			keys.discard(key)
+			if not keys:
+				del self.userkeys[key[1]]
+
+	def getRecommendations(self, person, similarity=sim_pearson, n=None):
+		'''
+		cached getRecommendations(prefs, person, similarity, n)
+		'''
+		key = ('user', person, similarity, n)
+		entry = self.lookup(key)
+		if entry is not None:
+			return list(entry[1])
+
+		result = getRecommendations(self.prefs, person, similarity, n, raterIndex=self.raterIndex)
+		neighbours = getNeighbours(self.prefs, self.raterIndex, person)
+		self.store(key, tuple(result), set(neighbours) | set([person]))
+		return result
+
+	def getRecommendedItems(self, itemsMatch, user, n=None):
+		'''
+		cached getRecommendedItems(prefs, itemsMatch, user, n)
+		the results are kept per item similarity table, call invalidate
+		when a table is changed in place
+		'''
+		key = ('items', user, id(itemsMatch), n)
+		entry = self.lookup(key)
+		if entry is not None:
+			return list(entry[1])
+
+		result = getRecommendedItems(self.prefs, itemsMatch, user, n)
+		# the table is kept with the result so its id can't be reused by another one
+		self.store(key, tuple(result), set([user]), itemsMatch)
+		return result
+
+	def addRating(self, user, item, rating):
+		'''
+		records a rating and drops every cached result that depends on it
+		'''
+		addRating(self.prefs, self.raterIndex, user, item, rating)
+
+		stale = set(self.dependents.get(user, ()))
+		for rater in self.raterIndex.get(item, ()):
+			stale.update(self.userkeys.get(rater, ()))
+
+		for key in stale:
+			self.drop(key)
+		self.invalidations += len(stale)
+
+	def invalidate(self, user=None):
+		'''
+		drops the results of user, or every result when user is None
+		'''
+		if user is None:
+			stale = list(self.entries)
+		else:
+			stale = [key for key in self.entries if key[1] == user]
+
+		for key in stale:
+			self.drop(key)
+		self.invalidations += len(stale)
@@ -1,4 +1,13 @@
 from math import sqrt
+import heapq
+import os
+
+from prefstore import PrefStore, TransposedPrefStore
+
+try:
+	import ratingstore
+except ImportError:  # numpy is not available, only the nested dicts are supported
+	ratingstore = None
 
 # A dictionary of item critics and their ratings of a small
 # set of items
@@ -80,29 +89,154 @@ def sim_tanimoto(prefs, person1, person2):
 	finds the intersection / union of the data sets
 	'''
 	intersection = [item for item in prefs[person1] if prefs[person2].get(item) == prefs[person1][item]]
-	return len(intersection) / (len(prefs[person1]) + len(prefs[person2]) - intersection)
+	return float(len(intersection)) / (len(prefs[person1]) + len(prefs[person2]) - len(intersection))
+
+
+# the similarity functions that have a batched version in ratingstore
+# for one user against every user and for a block of users against every user
+if ratingstore is not None:
+	batched_similarities = {
+		sim_distance: ratingstore.sim_distance_all,
+		sim_pearson: ratingstore.sim_pearson_all
+	}
+	block_similarities = {
+		sim_distance: ratingstore.sim_distance_block,
+		sim_pearson: ratingstore.sim_pearson_block
+	}
+	# and for one user against a few users, the candidates of an approximate index
+	candidate_similarities = {
+		sim_distance: ratingstore.sim_distance_among,
+		sim_pearson: ratingstore.sim_pearson_among
+	}
+else:
+	batched_similarities = {}
+	block_similarities = {}
+	candidate_similarities = {}
+
+
+def topScores(scores, n=None):
+	'''
+	returns the n highest (score, name) pairs in descending order, ties are
+	broken by the name the same way as sorting the pairs and reversing them
+	all the pairs are returned sorted when n is None
+	'''
+	if n is None:
+		return sorted(scores, reverse=True)
+	return heapq.nlargest(n, scores)
+
+
+def getBatchedSimilarity(prefs, similarity, versions=batched_similarities):
+	'''
+	returns the batched version of similarity when prefs is a RatingStore
+	and None when the scalar similarity has to be used
+	versions -> which batched versions, e.g. candidate_similarities
+	'''
+	if ratingstore is None or not isinstance(prefs, ratingstore.RatingStore):
+		return None
+	return versions.get(similarity)
+
+
+def scalarPrefs(prefs):
+	'''
+	prefs as a nested dict for the scalar similarities, a RatingStore is compiled once
+	'''
+	if ratingstore is not None and isinstance(prefs, ratingstore.RatingStore):
+		return prefs.asdict()
+	return prefs
 
 
-def topMatches(critics, person, n=5, similarity=sim_pearson):
+def topMatches(critics, person, n=5, similarity=sim_pearson, ann=None):
 	'''
 	return n critics who are most similar to person in a sorted order
+	critics can be the nested dict or a ratingstore.RatingStore
+	ann -> an approximate index from annindex, only the candidates it returns
+	for person are scored so some of the exact matches can be missed
+	'''
+	if ann is not None:
+		similarity_among = getBatchedSimilarity(critics, similarity, candidate_similarities)
+		if similarity_among is not None:
+			return ratingstore.topmatchesamong(critics, person, ratingstore.candidaterows(critics, ann, person), n,
+				similarity_among)
+		critics = scalarPrefs(critics)
+		others = ann.candidates(person)
+	else:
+		similarity_all = getBatchedSimilarity(critics, similarity)
+		if similarity_all is not None:
+			return ratingstore.topmatches(critics, person, n, similarity_all)
+		critics = scalarPrefs(critics)
+		others = critics
+
+	matches = ((similarity(critics, person, other), other) for other in others if other != person)
+
+	# keeps the n most similar critics in a bounded heap instead of sorting all of them
+	return topScores(matches, n)
+
+
+def buildRaterIndex(prefs):
+	'''
+	inverted index of every item and the set of users who rated it
+	keep it in step with prefs using addRating
+	'''
+	raterIndex = {}
+	for user in prefs:
+		for item in prefs[user]:
+			raterIndex.setdefault(item, set()).add(user)
+	return raterIndex
+
+
+def addRating(prefs, raterIndex, user, item, rating):
+	'''
+	records a rating in prefs and in the rater index built from prefs
+	'''
+	if isinstance(prefs, PrefStore):
+		prefs.addRating(user, item, rating)
+	else:
+		prefs.setdefault(user, {})[item] = rating
+	raterIndex.setdefault(item, set()).add(user)
+
+
+def getNeighbours(prefs, raterIndex, person, min_overlap=1):
+	'''
+	the users who rated at least min_overlap of the items rated by person
+	users sharing no items have a similarity of 0, so they never have to be scored
 	'''
-	matches = [(similarity(critics, person, other), other) for other in critics if other != person]
+	overlap = {}
+	for item in prefs[person]:
+		for other in raterIndex.get(item, ()):
+			overlap[other] = overlap.get(other, 0) + 1
 
-	# sorts and reverses the matches in place and returns n most similar critics
-	matches.sort()
-	matches.reverse()
-	return matches[0:n]
+	return [other for other, count in overlap.items() if count >= min_overlap and other != person]
 
 
-def getRecommendations(prefs, person, similarity=sim_pearson):
+def getRecommendations(prefs, person, similarity=sim_pearson, n=None, raterIndex=None, min_overlap=1):
 	'''
 	gets the recommendations for a person
+	prefs can be the nested dict or a ratingstore.RatingStore
+	only the n best recommendations are returned when n is given
+	only the users sharing at least min_overlap items with person take part
+	with a raterIndex from buildRaterIndex only those users are scored instead of
+	everyone in prefs. the neighbours are then summed in another order, so the scores
+	can differ in the last bits. a RatingStore does this on its own as it carries its
+	item to users arrays
 	'''
+	similarity_all = getBatchedSimilarity(prefs, similarity)
+	if similarity_all is not None:
+		return ratingstore.recommendations(prefs, person, similarity_all, n, min_overlap)
+	prefs = scalarPrefs(prefs)
+
 	sim_sums = {} # will hold the sums of the similarities
 	product_sums = {}  # will hold the sums of the products of the similarites and item ratings
 
-	for other in prefs:
+	if raterIndex is not None:
+		others = getNeighbours(prefs, raterIndex, person, min_overlap)
+	elif min_overlap > 1:
+		# users sharing no items score 0 anyway, so only a larger overlap has to be counted
+		others = [other for other in prefs
+			if len([item for item in prefs[person] if item in prefs[other]]) >= min_overlap]
+	else:
+		others = prefs
+
+	for other in others:
 		if other == person:  # a person can't recomment him/herself
 			continue
 
@@ -120,14 +254,45 @@ def getRecommendations(prefs, person, similarity=sim_pearson):
 			product_sums.setdefault(item,0)
 			product_sums[item] += prefs[other][item] * sim
 
-	recoms = [(sum_item / sim_sums[item], item) for item, sum_item in product_sums.items()]
+	recoms = ((sum_item / sim_sums[item], item) for item, sum_item in product_sums.items())
+
+	return topScores(recoms, n)
+
+
+def getRecommendationsBatch(prefs, users, similarity=sim_pearson, n=None, blocksize=None, chunksize=256,
+		blockbytes=None):
+	'''
+	yields (user, recommendations) for every user in users, the same as calling
+	getRecommendations for each of them up to rounding in the last bits
+	the similarities of blocksize users against everyone are computed as matrix
+	products and reused for the whole block, chunksize users at a time. a block
+	takes memory in proportion to the users plus the items, by default blocksize
+	is as many users as fit in blockbytes (ratingstore.BLOCKBYTES)
+	prefs can be the nested dict or a ratingstore.RatingStore
+	'''
+	if similarity not in block_similarities:
+		# no matrix version of this similarity, or no numpy
+		for user in users:
+			yield user, getRecommendations(prefs, user, similarity, n)
+		return
 
-	recoms.sort()
-	recoms.reverse()
-	return recoms
+	if not isinstance(prefs, ratingstore.RatingStore):
+		prefs = ratingstore.RatingStore.fromprefs(prefs)
+	if blockbytes is None:
+		blockbytes = ratingstore.BLOCKBYTES
+	for result in ratingstore.recommendationsbatch(prefs, users, block_similarities[similarity],
+			n, blocksize, chunksize, blockbytes):
+		yield result
 
 
 def transformPrefs(prefs):
+	'''
+	turns the user -> item ratings into item -> user ratings
+	a PrefStore is not copied, its transposed view is returned instead
+	'''
+	if isinstance(prefs, (PrefStore, TransposedPrefStore)):
+		return prefs.transpose()
+
 	results = {}
 	for critic in prefs:
 		for item in prefs[critic]:
@@ -161,6 +326,8 @@ def calculateSimilarItems(prefs, n=10):
 def calculateSimilarUsers(prefs, n=5):
 	'''
 	precomputes similar users
+	prefs can be the nested dict or a ratingstore.RatingStore
+	incremental.UserNeighbourIndex keeps the same table up to date as ratings arrive
 	'''
 	results = {}
 
@@ -169,18 +336,19 @@ def calculateSimilarUsers(prefs, n=5):
 	for user in prefs:
 		c += 1
 		if c % 100 == 0:
-			print "%d / %d" % (c,len(itemPrefs))
+			print "%d / %d" % (c,len(prefs))
 		results[user] = topMatches(prefs, user, n=n, similarity=sim_distance)
 
 	return results  # returns users with their n most similar users
 
-def getRecommendedItems(prefs, itemsMatch, user):
+def getRecommendedItems(prefs, itemsMatch, user, n=None):
 	'''
 	gets recommendations for a user using item based filtering
 	it uses the similarities between items the user has rated and the items the user
 	has not yet rated.
 	item based filtering is more efficient than user based filetering for a sparce
 	data but their perfomance on dense data data is almost the same.
+	only the n best recommendations are returned when n is given
 	'''
 	userRatings = prefs[user]
 
@@ -198,17 +366,39 @@ def getRecommendedItems(prefs, itemsMatch, user):
 			scores.setdefault(item2, 0)
 			scores[item2] += similarity * rating
 
-	recoms = [(score/totalSim[item], item) for item, score in scores.items()]
+	# items only reached through similarities of 0 have no weighted average
+	recoms = ((score/totalSim[item], item) for item, score in scores.items() if totalSim[item] != 0)
+
+	return topScores(recoms, n)
 
-	recoms.sort()
-	recoms.reverse()
-	return recoms
 
+def getRecommendedItemsBatch(prefs, itemsMatch, users, n=None, blocksize=None, blockbytes=None):
+	'''
+	yields (user, recommendations) for every user in users, the same as calling
+	getRecommendedItems for each of them
+	the scores of blocksize users are summed together over the similarity table,
+	by default as many users as fit in blockbytes (ratingstore.BLOCKBYTES)
+	prefs can be the nested dict or a ratingstore.RatingStore
+	'''
+	if ratingstore is None:
+		for user in users:
+			yield user, getRecommendedItems(prefs, itemsMatch, user, n)
+		return
+
+	if not isinstance(prefs, ratingstore.RatingStore):
+		prefs = ratingstore.RatingStore.fromprefs(prefs)
+	if blockbytes is None:
+		blockbytes = ratingstore.BLOCKBYTES
+	for result in ratingstore.recommendeditemsbatch(prefs, itemsMatch, users, n, blocksize, blockbytes):
+		yield result
 
-def loadMovieLens(path="/home/mirikwa/projects/ml/Programming-Collective-Intelligence/2.Recommendations/data"):
+
+def loadMovieLens(path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')):
 	'''
 	loads the movies data and composes the preferences
-	''' 
+	path defaults to the data directory next to this file
+	movielens.loadMovieLensArrays is much faster for the larger data sets
+	'''
 
 	# get the movie titles from u.item
 	# an example line is as below
@@ -0,0 +1,160 @@
+'''
+a compact on-disk format for the tables of calculateSimilarItems and
+calculateSimilarUsers
+the file is memory mapped when it is loaded, so the rows are read straight
+from the page cache and every process serving recommendations shares one copy.
+loading reads the header only, a name is decoded when a row or a neighbour needs
+it and a row is found by a binary search over the names in sorted order.
+
+layout (little endian):
+	header  -> magic 'PCISIM02', uint32 rows, uint32 width, uint64 names, uint64 names offset
+	ids     -> int32[rows][width], the neighbours of each row, -1 pads the short rows
+	scores  -> float32[rows][width], the similarities of the neighbours
+	names   -> uint64[names + 1] offsets into the utf-8 encoded names, then
+	           uint32[rows] the rows ordered by their encoded name, then the names
+row i holds the neighbours of names[i], the names after the first rows only
+appear as neighbours
+'''
+import os
+import mmap
+import struct
+
+import numpy as np
+
+try:
+	from collections.abc import Mapping
+except ImportError:  # python 2
+	from collections import Mapping
+
+MAGIC = b'PCISIM02'
+HEADER = struct.Struct('<8sIIQQ')
+
+
+def encodeName(name):
+	if isinstance(name, bytes):
+		return name
+	return name.encode('utf-8')
+
+
+def decodeName(raw):
+	if bytes is str:  # python 2 keeps the names as str
+		return raw
+	return raw.decode('utf-8')
+
+
+def saveSimilarities(table, path):
+	'''
+	writes a table of item -> [(score, other item), ...] to path
+	the file is written next to path and renamed over it so readers never see half a file
+	'''
+	names = list(table)
+	index = dict((name, i) for i, name in enumerate(names))
+	for scores in table.values():
+		for score, other in scores:
+			if other not in index:
+				index[other] = len(names)
+				names.append(other)
+
+	rows = len(table)
+	width = max([len(scores) for scores in table.values()] or [0])
+	ids = np.full((rows, width), -1, dtype='<i4')
+	values = np.zeros((rows, width), dtype='<f4')
+	for row in range(rows):
+		scores = table[names[row]]
+		ids[row, :len(scores)] = [index[other] for score, other in scores]
+		values[row, :len(scores)] = [score for score, other in scores]
+
+	encoded = [encodeName(name) for name in names]
+	offsets = np.zeros(len(names) + 1, dtype='<u8')
+	np.cumsum([len(raw) for raw in encoded], out=offsets[1:])
+	order = np.array(sorted(range(rows), key=lambda row: encoded[row]), dtype='<u4')
+	namesoffset = HEADER.size + ids.nbytes + values.nbytes
+
+	tmppath = path + '.tmp'
+	with open(tmppath, 'wb') as out:
+		out.write(HEADER.pack(MAGIC, rows, width, len(names), namesoffset))
+		out.write(ids.tobytes())
+		out.write(values.tobytes())
+		out.write(offsets.tobytes())
+		out.write(order.tobytes())
+		out.write(b''.join(encoded))
+	os.rename(tmppath, path)
+
+
+class SimilarityTable(Mapping):
+	'''
+	a read only, memory mapped table written by saveSimilarities
+	it behaves like the dict returned by calculateSimilarItems, table[item] decodes
+	the row of item into its list of (score, other item)
+	'''
+	def __init__(self, path):
+		with open(path, 'rb') as f:
+			self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, rows, width, count, namesoffset = HEADER.unpack_from(self.buffer, 0)
+		if magic != MAGIC:
+			raise ValueError('%s is not a similarity table' % path)
+
+		# views into the mapped file, nothing is copied
+		self.ids = np.frombuffer(self.buffer, dtype='<i4', count=rows * width,
+			offset=HEADER.size).reshape(rows, width)
+		self.scores = np.frombuffer(self.buffer, dtype='<f4', count=rows * width,
+			offset=HEADER.size + 4 * rows * width).reshape(rows, width)
+
+		self.offsets = np.frombuffer(self.buffer, dtype='<u8', count=count + 1, offset=namesoffset)
+		self.order = np.frombuffer(self.buffer, dtype='<u4', count=rows, offset=namesoffset + 8 * (count + 1))
+		self.start = namesoffset + 8 * (count + 1) + 4 * rows
+		self.rows = rows
+
+	def rawname(self, i):
+		return self.buffer[self.start + int(self.offsets[i]):self.start + int(self.offsets[i + 1])]
+
+	def name(self, i):
+		return decodeName(self.rawname(i))
+
+	def find(self, item):
+		'''
+		the row of item, -1 when it has none
+		'''
+		try:
+			key = encodeName(item)
+		except AttributeError:  # not a string, so not a name either
+			return -1
+		low, high = 0, self.rows
+		while low < high:
+			middle = (low + high) // 2
+			if self.rawname(self.order[middle]) < key:
+				low = middle + 1
+			else:
+				high = middle
+		if low < self.rows and self.rawname(self.order[low]) == key:
+			return int(self.order[low])
+		return -1
+
+	def __getitem__(self, item):
+		row = self.find(item)
+		if row < 0:
+			raise KeyError(item)
+		ids = self.ids[row]
+		ids = ids[ids >= 0]
+		return [(float(score), self.name(i)) for i, score in zip(ids.tolist(), self.scores[row, :len(ids)])]
+
+	def __iter__(self):
+		return (self.name(i) for i in range(self.rows))
+
+	def __len__(self):
+		return self.rows
+
+	def __contains__(self, item):
+		return self.find(item) >= 0
+
+	def close(self):
+		self.ids = self.scores = self.offsets = self.order = None
+		self.buffer.close()
+
+
+def loadSimilarities(path):
+	'''
+	memory maps a table written by saveSimilarities
+	'''
+	return SimilarityTable(path)
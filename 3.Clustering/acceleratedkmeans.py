@@ -0,0 +1,129 @@
+'''
+k-means with euclidean distance that skips the distances that can't change an assignment
+(Hamerly's algorithm)
+every row keeps an upper bound on the distance to its centroid and a lower
+bound on the distance to every other centroid. when the centroids move the
+bounds are loosened by how far they moved, instead of being computed again.
+a row whose upper bound is below its lower bound, or below half the distance
+from its centroid to the next closest centroid, keeps its centroid without
+computing any distance. otherwise the upper bound is tightened first, and only
+when that isn't enough are the distances to all k centroids computed.
+the assignments are the same as clusters.kcluster with clusters.euclidean.
+'''
+import random
+
+import numpy as np
+
+from clusters import euclidean, getmatrixdistance, kmeansplusplus, randomcentroids
+
+# bytes of the differences of a block of rows to all the centroids, bounds the memory of a full pass
+BLOCKBYTES = 64 << 20
+
+
+def rowdistances(data, clusters):
+	'''
+	the euclidean distance of every row of data to every centroid
+	'''
+	result = np.empty((len(data), len(clusters)))
+	# every row of a block takes len(clusters) x columns floats
+	blocksize = max(1, BLOCKBYTES // (8 * max(1, clusters.shape[0] * clusters.shape[1])))
+	for start in range(0, len(data), blocksize):
+		block = data[start:start + blocksize]
+		result[start:start + blocksize] = np.sqrt(((block[:, None, :] - clusters[None, :, :]) ** 2).sum(axis=2))
+	return result
+
+
+def assignfull(data, clusters, rows, assigned, upper, lower):
+	'''
+	assigns the given rows by computing their distances to all the centroids
+	and resets their bounds
+	'''
+	d = rowdistances(data[rows], clusters)
+	order = np.argsort(d, axis=1, kind='mergesort')  # stable, the first of equally close centroids wins
+	assigned[rows] = order[:, 0]
+	upper[rows] = d[np.arange(len(rows)), order[:, 0]]
+	lower[rows] = d[np.arange(len(rows)), order[:, 1]] if d.shape[1] > 1 else np.inf
+
+
+def kcluster(rows, k=4, init='random', tol=0.0, maxiter=100, seed=None, stats=None):
+	'''
+	the same clusters as clusters.kcluster(rows, clusters.euclidean, k)
+	init, tol, maxiter and seed are the options of clusters.kcluster
+	stats -> a dict that gets the number of distances computed, the number a plain
+	k-means would have computed, and the number saved
+	'''
+	rng = random if seed is None else random.Random(seed)
+	if init == 'kmeans++':
+		clusters = kmeansplusplus(rows, k, euclidean, getmatrixdistance(euclidean), rng)
+	elif init == 'random':
+		clusters = randomcentroids(rows, k, rng)
+	else:
+		raise ValueError("init must be 'random' or 'kmeans++'")
+
+	data = np.asarray(rows, dtype=np.float64)
+	clusters = np.array(clusters, dtype=np.float64)
+	n = len(data)
+
+	assigned = np.zeros(n, dtype=int)
+	upper = np.zeros(n)
+	lower = np.zeros(n)
+	assignfull(data, clusters, np.arange(n), assigned, upper, lower)
+	computed = n * k
+	iterations = 1
+	lastassigned = None
+
+	for iteration in range(maxiter):
+		print("Iteration {}".format(iteration))
+		if iteration > 0:
+			iterations += 1
+			# half the distance from every centroid to its closest other centroid
+			between = rowdistances(clusters, clusters)
+			np.fill_diagonal(between, np.inf)
+			half = between.min(axis=1) / 2 if k > 1 else np.full(k, np.inf)
+			# rowdistances fills the whole k x k matrix, both halves and the diagonal
+			computed += k * k
+
+			bound = np.maximum(half[assigned], lower)
+			check = np.flatnonzero(upper > bound)
+			# tighten the upper bound of the rows that might move
+			upper[check] = np.sqrt(((data[check] - clusters[assigned[check]]) ** 2).sum(axis=1))
+			computed += len(check)
+			moving = check[upper[check] > bound[check]]
+			assignfull(data, clusters, moving, assigned, upper, lower)
+			computed += len(moving) * k
+
+		# complete if cluster assignment is not changing
+		if lastassigned is not None and (assigned == lastassigned).all():
+			break
+		lastassigned = assigned.copy()
+
+		# moving the centroids to be the mean of the rows assigned to them, empty clusters stay
+		counts = np.bincount(assigned, minlength=k)
+		sums = np.zeros((k, data.shape[1]))
+		np.add.at(sums, assigned, data)
+		filled = counts > 0
+		moved = clusters.copy()
+		moved[filled] = sums[filled] / counts[filled][:, None]
+		shift = np.sqrt(((moved - clusters) ** 2).sum(axis=1))
+		clusters = moved
+
+		# loosen the bounds by how far the centroids moved
+		upper += shift[assigned]
+		if k > 1:
+			farthest = shift.argmax()
+			secondshift = np.partition(shift, k - 2)[k - 2]
+			lower -= np.where(assigned == farthest, secondshift, shift[farthest])
+
+		if shift.max() <= tol:
+			break
+
+	if stats is not None:
+		stats['computed'] = computed
+		stats['plain'] = n * k * iterations
+		stats['saved'] = n * k * iterations - computed
+		stats['iterations'] = iterations
+
+	bestmatches = [[] for j in range(k)]
+	for i, bestmatch in enumerate(assigned):
+		bestmatches[bestmatch].append(i)
+	return bestmatches
@@ -0,0 +1,174 @@
+'''
+hierarchical clustering that doesn't rescan every pair of clusters on each merge
+the distances between the live clusters are kept in a condensed matrix (the
+upper triangle as one array) and every cluster remembers its nearest
+neighbour. the neighbours sit in a heap, so finding the closest pair is a pop,
+and a merge only rescans the clusters whose nearest neighbour was one of the
+two merged ones. the merged cluster takes the slot of one of its children, so
+the matrix never grows.
+linkage decides the distance of a merged cluster to the others:
+	centroid -> the distance to the average of the two vectors, like clusters.hcluster
+	single, complete, average -> the min, max or size weighted mean of the two distances
+	ward -> the increase in variance, meant for clusters.euclidean
+all but centroid are Lance-Williams updates of the two old distances, so the
+vectors aren't compared again after the first pass.
+the result is a tree of clusters.bicluster, ready for printclust and drawdendrogram.
+'''
+import heapq
+
+import numpy as np
+
+import distances
+from clusters import bicluster, getmatrixdistance, pearson
+
+LINKAGES = ('centroid', 'single', 'complete', 'average', 'ward')
+
+
+def condensedindex(n, i, j):
+	'''
+	the positions of the pairs (i, j) in the condensed matrix of n rows, i and j never equal
+	'''
+	lo = np.minimum(i, j)
+	hi = np.maximum(i, j)
+	return n * lo - lo * (lo + 1) // 2 + hi - lo - 1
+
+
+def distancerows(rows, start, stop, distance, matrixdistance, prepared):
+	'''
+	the distances of rows[start:stop] to all the rows as a (stop - start) x len(rows) array
+	'''
+	if matrixdistance is not None:
+		return matrixdistance(prepared.data[start:stop], prepared)
+	return np.array([[distance(rows[i], other) for other in rows] for i in range(start, stop)])
+
+
+def lancewilliams(linkage, dka, dkb, dab, sizek, sizea, sizeb):
+	'''
+	the distances of the clusters k to the merge of a and b from their distances to a and b
+	'''
+	if linkage == 'single':
+		return np.minimum(dka, dkb)
+	if linkage == 'complete':
+		return np.maximum(dka, dkb)
+	if linkage == 'average':
+		return (sizea * dka + sizeb * dkb) / (sizea + sizeb)
+	# ward
+	total = sizek + sizea + sizeb
+	return np.sqrt(np.maximum(((sizek + sizea) * dka ** 2 + (sizek + sizeb) * dkb ** 2 - sizek * dab ** 2) / total, 0))
+
+
+def agglomerate(rows, distance=pearson, linkage='centroid', blocksize=256):
+	'''
+	the same kind of tree as clusters.hcluster in about n^2 log n steps
+	linkage -> one of LINKAGES
+	blocksize -> rows compared at once when filling the matrix, bounds the memory of that pass
+	the merged clusters get the ids -1, -2, ... in the order they are made, vec is
+	the average of the two merged vectors and the children are on the same sides, like in hcluster
+	'''
+	if linkage not in LINKAGES:
+		raise ValueError('linkage must be one of %s' % ', '.join(LINKAGES))
+
+	n = len(rows)
+	nodes = [bicluster(rows[i], id=i) for i in range(n)]
+	if n < 2:
+		return nodes[0] if nodes else None
+
+	matrixdistance = getmatrixdistance(distance)
+	prepared = None
+	if matrixdistance is not None:
+		prepared = distances.rowstats(rows)
+		vectors = np.array(prepared.data, dtype=np.float64)  # the vectors of the live clusters by slot, for centroid
+
+	# the upper triangle of the distances, and the nearest neighbour of every row
+	condensed = np.empty(n * (n - 1) // 2)
+	nearest = np.zeros(n, dtype=int)
+	nearestdistance = np.zeros(n)
+	for start in range(0, n, blocksize):
+		stop = min(start + blocksize, n)
+		block = np.asarray(distancerows(rows, start, stop, distance, matrixdistance, prepared), dtype=np.float64)
+		for i in range(start, stop):
+			row = block[i - start]
+			if i + 1 < n:
+				begin = condensedindex(n, i, i + 1)
+				condensed[begin:begin + n - i - 1] = row[i + 1:]
+			row[i] = np.inf
+			nearest[i] = row.argmin()
+			nearestdistance[i] = row[nearest[i]]
+
+	active = np.ones(n, dtype=bool)
+	sizes = np.ones(n)
+	versions = np.zeros(n, dtype=int)  # entries of the heap with an older version are stale
+	# where every live cluster would stand in the list of hcluster, which appends the merges at the end
+	order = np.arange(n)
+	heap = [(nearestdistance[i], i, 0) for i in range(n)]
+	heapq.heapify(heap)
+
+	def rescan(k, others):
+		'''
+		finds the nearest neighbour of k among others again
+		'''
+		others = others[others != k]
+		row = condensed[condensedindex(n, k, others)]
+		best = row.argmin()
+		nearest[k] = others[best]
+		nearestdistance[k] = row[best]
+
+	def push(k):
+		versions[k] += 1
+		heapq.heappush(heap, (nearestdistance[k], k, versions[k]))
+
+	currentclustid = -1
+	for merge in range(n - 1):
+		while True:
+			lowest_distance, i, version = heapq.heappop(heap)
+			if active[i] and version == versions[i]:
+				break
+		a, b = sorted((i, nearest[i]))
+
+		mergevec = [(nodes[a].vec[x] + nodes[b].vec[x]) / 2.0 for x in range(len(nodes[a].vec))]
+		# the child coming first in the list of hcluster goes on the left
+		left, right = (nodes[a], nodes[b]) if order[a] < order[b] else (nodes[b], nodes[a])
+		nodes[a] = bicluster(mergevec, left=left, right=right, id=currentclustid, distance=lowest_distance)
+		order[a] = n + merge
+		currentclustid -= 1
+		active[b] = False
+		versions[b] += 1
+		nodes[b] = None
+
+		others = np.flatnonzero(active)
+		others = others[others != a]
+		if len(others) == 0:
+			break
+
+		positions = condensedindex(n, a, others)
+		if linkage == 'centroid':
+			if matrixdistance is not None:
+				vectors[a] = mergevec
+				newrow = matrixdistance(vectors[others], vectors[a])[:, 0]
+			else:
+				newrow = np.array([distance(nodes[k].vec, mergevec) for k in others])
+		else:
+			dka = condensed[positions]
+			dkb = condensed[condensedindex(n, b, others)]
+			newrow = lancewilliams(linkage, dka, dkb, lowest_distance, sizes[others], sizes[a], sizes[b])
+		condensed[positions] = newrow
+		sizes[a] += sizes[b]
+
+		best = newrow.argmin()
+		nearest[a] = others[best]
+		nearestdistance[a] = newrow[best]
+		push(a)
+
+		# the clusters that were nearest to a or b look again, the others only compare with the merge
+		lost = (nearest[others] == a) | (nearest[others] == b)
+		closer = ~lost & (newrow < nearestdistance[others])
+		alive = np.append(others, a)
+		for k in others[lost]:
+			rescan(k, alive)
+			push(k)
+		for k, d in zip(others[closer], newrow[closer]):
+			nearest[k] = a
+			nearestdistance[k] = d
+			push(k)
+
+	return nodes[0]
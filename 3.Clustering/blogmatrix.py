@@ -0,0 +1,333 @@
+'''
+compact forms of the blogdata.txt matrix read by clusters.readfile
+the file is read a line at a time and every row is turned into a numpy array
+straight away, either kept dense as float32 or reduced to its non zero counts.
+the sparse rows form a csrmatrix: the column ids and counts of all the rows one
+after the other, and indptr telling where every row starts.
+a parsed matrix can be saved into a directory and memory mapped from there:
+	rownames, colnames -> names.pkl
+	dense -> data.npy, a rows x columns array
+	sparse -> indptr.npy, indices.npy, values.npy and shape.npy
+so reading it again costs next to nothing whatever the size of the text file.
+generatefeedvector.py can also write a csrmatrix straight to a compressed .npz
+file holding the same arrays plus rownames and colnames as utf-8, for storing and
+shipping the matrix rather than mapping it.
+'''
+import os
+import pickle
+from array import array
+
+import numpy as np
+
+# the products of entries taken at once by csrmatrix.dotrows, bounds its memory
+PAIRBLOCK = 1 << 21
+
+
+class csrmatrix():
+	def __init__(self, indptr, indices, values, shape):
+		'''
+		indptr -> row i has the entries indptr[i] to indptr[i+1]
+		indices, values -> the column ids and counts of the entries
+		shape -> (rows, columns)
+		'''
+		self.indptr = indptr
+		self.indices = indices
+		self.values = values
+		self.shape = tuple(int(x) for x in shape)
+		self.columnview = None  # the entries in column order, made by columns on first use
+
+	def row(self, i):
+		'''
+		the column ids and counts of the non zero entries of row i
+		'''
+		start, end = self.indptr[i], self.indptr[i + 1]
+		return self.indices[start:end], self.values[start:end]
+
+	def __getitem__(self, i):
+		'''
+		row i as a dense array, so the rows can be used like the lists of readfile
+		a slice of rows gives a csrmatrix of those rows
+		'''
+		if isinstance(i, slice):
+			start, stop, step = i.indices(self.shape[0])
+			if step != 1:
+				raise ValueError('only contiguous rows can be sliced')
+			indptr = self.indptr[start:max(start, stop) + 1]
+			return csrmatrix(indptr - indptr[0], self.indices[indptr[0]:indptr[-1]], self.values[indptr[0]:indptr[-1]],
+				(len(indptr) - 1, self.shape[1]))
+		if i < 0:
+			i += self.shape[0]
+		if not 0 <= i < self.shape[0]:
+			raise IndexError(i)
+		dense = np.zeros(self.shape[1], dtype=self.values.dtype)
+		columns, counts = self.row(i)
+		dense[columns] = counts
+		return dense
+
+	def __len__(self):
+		return self.shape[0]
+
+	def __iter__(self):
+		for i in range(self.shape[0]):
+			yield self[i]
+
+	def take(self, rows):
+		'''
+		the csrmatrix of the given rows in their order, a row can be taken more than once
+		'''
+		rows = np.asarray(rows, dtype=np.int64)
+		starts = self.indptr[rows]
+		counts = self.indptr[rows + 1] - starts
+		indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+		np.cumsum(counts, out=indptr[1:])
+		positions = np.repeat(starts - indptr[:-1], counts) + np.arange(indptr[-1])
+		return csrmatrix(indptr, self.indices[positions], self.values[positions], (len(rows), self.shape[1]))
+
+	def rowids(self):
+		'''
+		the row of every entry
+		'''
+		return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+	def toarray(self):
+		dense = np.zeros(self.shape, dtype=self.values.dtype)
+		dense[self.rowids(), self.indices] = self.values
+		return dense
+
+	def dot(self, other):
+		'''
+		the product with the dense columns x p matrix other, as a rows x p float64 array
+		'''
+		other = np.asarray(other)
+		rows = self.rowids()
+		result = np.empty((self.shape[0], other.shape[1]))
+		for j in range(other.shape[1]):
+			result[:, j] = np.bincount(rows, weights=self.values * other[self.indices, j], minlength=self.shape[0])
+		return result
+
+	def columns(self):
+		'''
+		the entries ordered by column, as colptr and the rows and values of every column
+		column j has the entries colptr[j] to colptr[j+1]
+		'''
+		if self.columnview is None:
+			order = np.argsort(self.indices, kind='mergesort')
+			colptr = np.zeros(self.shape[1] + 1, dtype=np.int64)
+			np.cumsum(np.bincount(self.indices, minlength=self.shape[1]), out=colptr[1:])
+			self.columnview = colptr, self.rowids()[order], self.values[order]
+		return self.columnview
+
+	def dotrows(self, other, blockpairs=PAIRBLOCK):
+		'''
+		the dot product of every row with every row of the csrmatrix other, as a
+		rows x other rows float64 array
+		every entry is multiplied with the entries of other in its column only, a
+		block of rows at a time holding about blockpairs of those products
+		'''
+		colptr, colrows, colvals = other.columns()
+		colcounts = np.diff(colptr)
+		rows = self.rowids()
+		# the products made by every row, summed up like indptr
+		pairptr = np.zeros(self.shape[0] + 1, dtype=np.int64)
+		np.cumsum(np.bincount(rows, weights=colcounts[self.indices], minlength=self.shape[0]).astype(np.int64),
+			out=pairptr[1:])
+
+		result = np.empty((self.shape[0], other.shape[0]))
+		start = 0
+		while start < self.shape[0]:
+			end = int(np.searchsorted(pairptr, pairptr[start] + blockpairs, side='right')) - 1
+			end = min(max(end, start + 1), self.shape[0])
+			first, last = self.indptr[start], self.indptr[end]
+			columns = self.indices[first:last]
+			counts = colcounts[columns]
+			# the entries of other in the column of every entry, one run after the other
+			positions = np.repeat(colptr[columns] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+			cells = np.repeat(rows[first:last] - start, counts) * other.shape[0] + colrows[positions]
+			weights = np.repeat(self.values[first:last].astype(np.float64), counts) * colvals[positions]
+			result[start:end] = np.bincount(cells, weights=weights,
+				minlength=(end - start) * other.shape[0]).reshape(end - start, other.shape[0])
+			start = end
+		return result
+
+	def sumrows(self, groups, ngroups):
+		'''
+		the sums of the rows of every group as an ngroups x columns float64 array
+		groups -> the group of every row, from 0 to ngroups - 1
+		'''
+		bins = np.asarray(groups)[self.rowids()] * self.shape[1] + self.indices
+		return np.bincount(bins, weights=self.values, minlength=ngroups * self.shape[1]).reshape(ngroups, self.shape[1])
+
+	def columnranges(self):
+		'''
+		the minimum and maximum of every column, the missing entries count as 0
+		'''
+		# a column with an entry in every row doesn't have any 0
+		full = np.bincount(self.indices, minlength=self.shape[1]) == self.shape[0]
+		mins = np.where(full, np.inf, 0.0)
+		maxs = np.where(full, -np.inf, 0.0)
+		np.minimum.at(mins, self.indices, self.values)
+		np.maximum.at(maxs, self.indices, self.values)
+		return mins, maxs
+
+	def __array__(self, dtype=None):
+		dense = self.toarray()
+		return dense if dtype is None else dense.astype(dtype)
+
+
+def parse(lines, dtype=np.float32, sparse=False):
+	'''
+	the rownames, colnames and matrix of the lines of a blogdata.txt file
+	'''
+	lines = iter(lines)
+	colnames = next(lines).strip().split('\t')[1:]
+	rownames = []
+
+	if sparse:
+		indptr = array('l', [0])
+		indices = array('i')
+		values = []
+	else:
+		rows = []
+
+	for line in lines:
+		p = line.strip().split('\t')
+		if len(p) < 2:
+			continue
+		rownames.append(p[0])
+		counts = np.array([float(x) for x in p[1:]], dtype=dtype)
+		if sparse:
+			columns = np.flatnonzero(counts)
+			indices.extend(columns.tolist())
+			values.append(counts[columns])
+			indptr.append(len(indices))
+		else:
+			rows.append(counts)
+
+	if sparse:
+		values = np.concatenate(values) if values else np.zeros(0, dtype=dtype)
+		matrix = csrmatrix(np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int32), values,
+			(len(rownames), len(colnames)))
+	else:
+		matrix = np.vstack(rows) if rows else np.zeros((0, len(colnames)), dtype=dtype)
+	return rownames, colnames, matrix
+
+
+def fromcounts(rows, colnames, dtype=np.float32):
+	'''
+	the csrmatrix of rows, dicts of column name -> count
+	'''
+	columnindex = dict((name, i) for i, name in enumerate(colnames))
+	indptr = array('l', [0])
+	indices = array('i')
+	values = array('d')
+	for counts in rows:
+		entries = sorted((columnindex[name], count) for name, count in counts.items()
+			if name in columnindex and count != 0)
+		indices.extend([column for column, count in entries])
+		values.extend([count for column, count in entries])
+		indptr.append(len(indices))
+	return csrmatrix(np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int32),
+		np.array(values, dtype=dtype), (len(indptr) - 1, len(colnames)))
+
+
+def encodenames(names):
+	'''
+	the names as an array of utf-8 bytes, byte strings are taken to be utf-8 already
+	'''
+	return np.array([name if isinstance(name, bytes) else name.encode('utf-8') for name in names], dtype=bytes)
+
+
+def decodenames(names):
+	'''
+	the unicode names of an array written by encodenames
+	'''
+	return [name.decode('utf-8') for name in names.tolist()]
+
+
+def savenpz(filename, rownames, colnames, matrix):
+	'''
+	writes the names and a csrmatrix into one compressed .npz file
+	'''
+	np.savez_compressed(filename, indptr=matrix.indptr, indices=matrix.indices, values=matrix.values,
+		shape=np.array(matrix.shape, dtype=np.int64), rownames=encodenames(rownames),
+		colnames=encodenames(colnames))
+
+
+def loadnpz(filename):
+	'''
+	reads what savenpz wrote
+	'''
+	with np.load(filename) as f:
+		matrix = csrmatrix(f['indptr'], f['indices'], f['values'], f['shape'])
+		return decodenames(f['rownames']), decodenames(f['colnames']), matrix
+
+
+def save(directory, rownames, colnames, matrix):
+	'''
+	writes the names and the dense array or csrmatrix into directory
+	'''
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	# a directory without the names is an unfinished cache, they are written last
+	for name in ('names.pkl', 'data.npy', 'indptr.npy', 'indices.npy', 'values.npy', 'shape.npy'):
+		if os.path.exists(os.path.join(directory, name)):
+			os.remove(os.path.join(directory, name))
+
+	if isinstance(matrix, csrmatrix):
+		np.save(os.path.join(directory, 'indptr.npy'), matrix.indptr)
+		np.save(os.path.join(directory, 'indices.npy'), matrix.indices)
+		np.save(os.path.join(directory, 'values.npy'), matrix.values)
+		np.save(os.path.join(directory, 'shape.npy'), np.array(matrix.shape, dtype=np.int64))
+	else:
+		np.save(os.path.join(directory, 'data.npy'), matrix)
+	with open(os.path.join(directory, 'names.pkl'), 'wb') as f:
+		pickle.dump((rownames, colnames), f, pickle.HIGHEST_PROTOCOL)
+
+
+def load(directory, mmap_mode='r'):
+	'''
+	reads what save wrote, the arrays are memory mapped read only by default
+	'''
+	with open(os.path.join(directory, 'names.pkl'), 'rb') as f:
+		rownames, colnames = pickle.load(f)
+
+	def part(name):
+		return np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+
+	if os.path.exists(os.path.join(directory, 'indptr.npy')):
+		matrix = csrmatrix(part('indptr'), part('indices'), part('values'), np.load(os.path.join(directory, 'shape.npy')))
+	else:
+		matrix = part('data')
+	return rownames, colnames, matrix
+
+
+def iscached(directory, dtype, sparse, filename=None):
+	'''
+	true when directory holds a finished matrix of the right kind and dtype, newer than filename
+	'''
+	names = os.path.join(directory, 'names.pkl')
+	if not os.path.exists(names):
+		return False
+	if filename is not None and os.path.getmtime(names) < os.path.getmtime(filename):
+		return False
+	if os.path.exists(os.path.join(directory, 'indptr.npy')) != bool(sparse):
+		return False
+	values = np.load(os.path.join(directory, 'values.npy' if sparse else 'data.npy'), mmap_mode='r')
+	return values.dtype == np.dtype(dtype)
+
+
+def readfile(filename, dtype=np.float32, sparse=False, cache=None):
+	'''
+	clusters.readfile into a dense array or a csrmatrix
+	cache -> a directory for the parsed matrix, loaded instead of filename when it is up to date
+	'''
+	if cache is not None and iscached(cache, dtype, sparse, filename):
+		return load(cache)
+
+	with open(filename) as f:
+		rownames, colnames, matrix = parse(f, dtype, sparse)
+
+	if cache is not None:
+		save(cache, rownames, colnames, matrix)
+		return load(cache)
+	return rownames, colnames, matrix
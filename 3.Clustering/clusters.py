@@ -1,24 +1,56 @@
 from math import sqrt
 from PIL import Image, ImageDraw
+import heapq
+import multiprocessing
+import os
 import random
+import time
 
+try:
+	from concurrent.futures import ProcessPoolExecutor
+except ImportError:  # python 2 without the futures backport, the restarts run one after the other
+	ProcessPoolExecutor = None
 
-def readfile(filename):
+try:
+	import numpy as np
+	import blogmatrix
+	import distances
+except ImportError:  # numpy is not installed, only the scalar distances and text files are used
+	np = None
+	blogmatrix = None
+	distances = None
+
+
+def readfile(filename, dtype=None, sparse=False, cache=None):
 	'''
 	reads the file of the data
 	the first row contains the words used in the clustering
 	the rest of the rows contain the counts of the words
 	the first column contains the titles of the blogs
 	the rest of the columns contain the counts of the words
+	the lines are read one at a time, and with numpy the counts can be kept compact:
+	dtype -> e.g. 'float32', the counts come back as a numpy array of that type
+	sparse -> the counts come back as a blogmatrix.csrmatrix of the non zero counts
+	cache -> a directory for a binary copy of the parsed counts, which is memory mapped
+	instead of reading filename again as long as filename doesn't change
+	filename can also be a directory written by blogmatrix.save, or a .npz file
+	written by blogmatrix.savenpz, both give a csrmatrix for sparse counts
 	'''
-	lines = [line for line in file(filename)]
+	if os.path.isdir(filename):
+		return blogmatrix.load(filename)
+	if filename.endswith('.npz'):
+		return blogmatrix.loadnpz(filename)
+	if dtype is not None or sparse or cache is not None:
+		return blogmatrix.readfile(filename, dtype or 'float32', sparse, cache)
+
+	lines = file(filename)
 
-	colnames = lines[0].strip().split('\t')[1:]
+	colnames = next(lines).strip().split('\t')[1:]
 
 	rownames = []
 	wordcounts = []
 
-	for line in lines[1:]:
+	for line in lines:
 		p = line.strip().split('\t')
 		rownames.append(p[0])
 		wordcounts.append([float(x) for x in p[1:]])
@@ -55,9 +87,32 @@ def pearson(v1, v2):
 	return 1.0 - num / denom  # for similar items the return value will be small
 
 
+def euclidean(v1, v2):
+	'''
+	the straight line distance between the vectors
+	'''
+	return sqrt(sum([pow(v1[i] - v2[i], 2) for i in range(len(v1))]))
+
+
+def getmatrixdistance(distance):
+	'''
+	the numpy version of distance from distances.py, which compares all the rows at once
+	None when numpy is missing or distance has no numpy version
+	'''
+	if distances is None:
+		return None
+	return {
+		pearson: distances.pearsonmatrix,
+		tanimoto: distances.tanimotomatrix,
+		euclidean: distances.euclideanmatrix
+	}.get(distance)
+
+
 # modeling the cluster
 # a node is either a point in the dataset(a blog in this case)
 # or a point in the tree with 2 branches
+# every node also keeps the height (number of endpoints) and depth of its subtree,
+# so drawing a tree doesn't walk the subtrees again
 class bicluster():
 	def __init__(self, vec, left=None, right=None, distance=0.0, id=None):
 		self.vec = vec
@@ -65,11 +120,19 @@ class bicluster():
 		self.right = right
 		self.distance = distance
 		self.id = id
+		if left is None and right is None:
+			self.height = 1
+			self.depth = 0
+		elif left is not None and right is not None and hasattr(left, 'height') and hasattr(right, 'height'):
+			self.height = left.height + right.height
+			self.depth = max(left.depth, right.depth) + distance
 
 
 def hcluster(rows, distance=pearson):
 	'''
 	Hierachical clustering function
+	when distance has a numpy version all the initial distances are computed
+	in one call, and the distances of every merged cluster in another
 	'''
 	distances = {}
 	currentclustid = -1  # clusters with branches will have -ve ids
@@ -77,9 +140,18 @@ def hcluster(rows, distance=pearson):
 	# initially the clusters are just the rows
 	clusters = [bicluster(rows[i], id=i) for i in range(len(rows))]
 
+	matrixdistance = getmatrixdistance(distance)
+	if matrixdistance is not None:
+		initial = matrixdistance(rows)
+		for i in range(len(rows)):
+			for j in range(i+1, len(rows)):
+				distances[(i, j)] = initial[i][j]
+
 	while len(clusters) > 1:
 		closest = (0, 1)
-		lowest_distance = distance(clusters[0].vec, clusters[1].vec)
+		if (clusters[0].id, clusters[1].id) not in distances:
+			distances[(clusters[0].id, clusters[1].id)] = distance(clusters[0].vec, clusters[1].vec)
+		lowest_distance = distances[(clusters[0].id, clusters[1].id)]
 
 		for i in range(len(clusters)):
 			for j in range(i+1, len(clusters)):
@@ -93,31 +165,73 @@ def hcluster(rows, distance=pearson):
 
 		# merging the closest vectors
 		# the merged vector will be the mean of the closest vectors
-		mergevec = [(clusters[closest[0]].vec[i] + clusters[closest[1]].vec[i]) / 2.0 for x in range(len(clusters[0].vec))]
+		mergevec = [(clusters[closest[0]].vec[x] + clusters[closest[1]].vec[x]) / 2.0 for x in range(len(clusters[0].vec))]
 
 		new_cluster = bicluster(mergevec, left=clusters[closest[0]], right=clusters[closest[1]], id=currentclustid, distance=lowest_distance)
 
 		currentclustid -= 1
 		del clusters[closest[1]]
 		del clusters[closest[0]]
+
+		if matrixdistance is not None and len(clusters) > 0:
+			# the distances of the new cluster to the remaining ones in one call
+			newdistances = matrixdistance([c.vec for c in clusters], [mergevec])
+			for i in range(len(clusters)):
+				distances[(clusters[i].id, new_cluster.id)] = newdistances[i][0]
+
 		clusters.append(new_cluster)
 
 	return clusters[0]
 
 
 def printclust(clust,labels=None,n=0):
-	# indent to make a hierarchy layout
-	for i in range(n): print ' ',
-	if clust.id<0:
-		# negative id means that this is branch
-		print '-'
-	else:
-		# positive id means that this is an endpoint
-		if labels==None: print clust.id
-		else: print labels[clust.id]
-	# now print the right and left branches
-	if clust.left!=None: printclust(clust.left,labels=labels,n=n+1)
-	if clust.right!=None: printclust(clust.right,labels=labels,n=n+1)
+	'''
+	prints the tree with one line per node, indented by its level
+	the nodes are visited with a stack, so deep trees don't hit the recursion limit
+	'''
+	stack = [(clust, n)]
+	while stack:
+		clust, n = stack.pop()
+		# indent to make a hierarchy layout
+		for i in range(n): print ' ',
+		if clust.id<0:
+			# negative id means that this is branch
+			print '-'
+		else:
+			# positive id means that this is an endpoint
+			if labels==None: print clust.id
+			else: print labels[clust.id]
+		# now print the left and right branches, the left one is popped first
+		if clust.right!=None: stack.append((clust.right, n+1))
+		if clust.left!=None: stack.append((clust.left, n+1))
+
+
+def postorder(clust):
+	'''
+	the nodes of the tree, every node after its branches, without recursion
+	'''
+	nodes = []
+	stack = [clust]
+	while stack:
+		node = stack.pop()
+		nodes.append(node)
+		if node.left != None: stack.append(node.left)
+		if node.right != None: stack.append(node.right)
+	nodes.reverse()
+	return nodes
+
+
+def cacheshape(clust):
+	'''
+	sets the height and depth of every node of a tree built without them
+	'''
+	for node in postorder(clust):
+		if node.left == None and node.right == None:
+			node.height = 1
+			node.depth = 0
+		else:
+			node.height = node.left.height + node.right.height
+			node.depth = max(node.left.depth, node.right.depth) + node.distance
 
 
 def getheight(clust):
@@ -125,56 +239,121 @@ def getheight(clust):
 	The height will be 1 if the cluster is an end point, otherwise it will be the sum
 	of the heights of the children nodes of the node
 	'''
-	if clust.left == None and clust.right == None:
-		return 1
-	return getheight(clust.left) + getheight(clust.right)
+	if not hasattr(clust, 'height'):
+		cacheshape(clust)
+	return clust.height
 
 def getdepth(clust):
 	'''
 	The depth will be 0 for an endpoint, otherwise it will be the sum of its depth
 	and the max of the depths of its children nodes
 	'''
-	if clust.left == None and clust.right == None:
-		return 0
-	return max(getdepth(clust.left), getdepth(clust.right)) + clust.distance
+	if not hasattr(clust, 'depth'):
+		cacheshape(clust)
+	return clust.depth
+
+
+def topmerges(clust, n):
+	'''
+	the n branches with the largest distances, taken from the root down,
+	the branches below them are drawn as endpoints
+	'''
+	expanded = set()
+	heap = [(-clust.distance, 0, clust)]
+	count = 1
+	while heap and len(expanded) < n:
+		distance, i, node = heapq.heappop(heap)
+		if node.left == None or node.right == None:
+			continue
+		expanded.add(node)
+		for branch in (node.left, node.right):
+			heapq.heappush(heap, (-branch.distance, count, branch))
+			count += 1
+	return expanded
+
+
+def visibleheights(clust, expanded):
+	'''
+	the heights of the drawn nodes when only the expanded branches are opened
+	'''
+	heights = {}
+	for node in postorder(clust):
+		if node in expanded:
+			heights[node] = heights[node.left] + heights[node.right]
+		else:
+			heights[node] = 1
+	return heights
+
+
+def nodelabel(clust, labels):
+	'''
+	the label of an endpoint, or of a branch drawn as an endpoint: its first label and the number of the others
+	'''
+	first = clust
+	while first.left != None:
+		first = first.left
+	if first is clust:
+		return labels[clust.id]
+	return '%s + %d more' % (labels[first.id], getheight(clust) - 1)
 
 
-def drawdendrogram(clust,labels,jpeg='clusters.jpg'):
+def drawdendrogram(clust,labels,jpeg='clusters.jpg',maxmerges=None):
+	'''
+	maxmerges -> only draw the branches of the maxmerges largest merges, the clusters
+	below them are drawn as single labelled endpoints
+	'''
+	expanded = None
+	heights = None
+	if maxmerges is not None:
+		expanded = topmerges(clust, maxmerges)
+		heights = visibleheights(clust, expanded)
+
 	# height and width
-	h = getheight(clust) * 20
+	h = (heights[clust] if heights is not None else getheight(clust)) * 20
 	w = 1200
 	depth = getdepth(clust)
 	# width is fixed, so scale distances accordingly
-	scaling = float(w - 150) / depth
+	scaling = float(w - 150) / depth if depth else 0
 	# Create a new image with a white background
 	img = Image.new('RGB', (w, h), (255, 255, 255))
 	draw = ImageDraw.Draw(img)
 	draw.line((0, h/2, 10, h/2), fill=(255, 0, 0))
 	# Draw the first node
-	drawnode(draw,clust,10,(h/2),scaling,labels)
+	drawnode(draw,clust,10,(h/2),scaling,labels,expanded,heights)
 	img.save(jpeg,'JPEG')
 
 
-def drawnode(draw,clust,x,y,scaling,labels):
-	if clust.id<0:
-		h1=getheight(clust.left)*20
-		h2=getheight(clust.right)*20
-		top=y-(h1+h2)/2
-		bottom=y+(h1+h2)/2
-		# Line length
-		ll=clust.distance*scaling
-		# Vertical line from this cluster to children
-		draw.line((x,top+h1/2,x,bottom-h2/2),fill=(255,0,0))
-		# Horizontal line to left item
-		draw.line((x,top+h1/2,x+ll,top+h1/2),fill=(255,0,0))
-		# Horizontal line to right item
-		draw.line((x,bottom-h2/2,x+ll,bottom-h2/2),fill=(255,0,0))
-		# Call the function to draw the left and right nodes
-		drawnode(draw,clust.left,x+ll,top+h1/2,scaling,labels)
-		drawnode(draw,clust.right,x+ll,bottom-h2/2,scaling,labels)
-	else:
-		# If this is an endpoint, draw the item label
-		draw.text((x+5,y-7),labels[clust.id],(0,0,0))
+def drawnode(draw,clust,x,y,scaling,labels,expanded=None,heights=None):
+	'''
+	draws the node at x, y and everything below it, the nodes waiting to be drawn are kept on a stack
+	expanded, heights -> the branches opened and the heights from drawdendrogram when it truncates the tree
+	'''
+	stack = [(clust, x, y)]
+	while stack:
+		clust, x, y = stack.pop()
+		if clust.left != None and clust.right != None and (expanded is None or clust in expanded):
+			if heights is None:
+				h1=getheight(clust.left)*20
+				h2=getheight(clust.right)*20
+			else:
+				h1=heights[clust.left]*20
+				h2=heights[clust.right]*20
+			top=y-(h1+h2)/2
+			bottom=y+(h1+h2)/2
+			# Line length
+			ll=clust.distance*scaling
+			# Vertical line from this cluster to children
+			draw.line((x,top+h1/2,x,bottom-h2/2),fill=(255,0,0))
+			# Horizontal line to left item
+			draw.line((x,top+h1/2,x+ll,top+h1/2),fill=(255,0,0))
+			# Horizontal line to right item
+			draw.line((x,bottom-h2/2,x+ll,bottom-h2/2),fill=(255,0,0))
+			# the left and right nodes are drawn next
+			stack.append((clust.right,x+ll,bottom-h2/2))
+			stack.append((clust.left,x+ll,top+h1/2))
+		else:
+			# If this is an endpoint, draw the item label
+			draw.text((x+5,y-7),nodelabel(clust,labels),(0,0,0))
 
 
 def rotatematrix(data):
@@ -190,7 +369,115 @@ def rotatematrix(data):
 	return newdata
 
 
-def kcluster(rows, distance=pearson, k=4):
+def nearestcentroids(rows, clusters, distance, matrixdistance):
+	'''
+	the index of the closest centroid for every row, and its distance
+	the first of equally close centroids wins
+	'''
+	if matrixdistance is not None:
+		d = matrixdistance(rows, clusters)
+		best = d.argmin(axis=1)
+		return list(best), list(d[range(len(best)), best])
+
+	bestmatches = []
+	bestdistances = []
+	for row in rows:
+		bestmatch = 0
+		bestdistance = distance(row, clusters[0])
+		for j in range(1, len(clusters)):
+			d = distance(row, clusters[j])
+			if d < bestdistance:
+				bestmatch = j
+				bestdistance = d
+		bestmatches.append(bestmatch)
+		bestdistances.append(bestdistance)
+	return bestmatches, bestdistances
+
+
+def isnumpy(rows):
+	'''
+	true when rows is a numpy array or a blogmatrix.csrmatrix, whose columns are better handled by numpy
+	'''
+	return np is not None and isinstance(rows, (np.ndarray, blogmatrix.csrmatrix))
+
+
+def columnranges(rows):
+	'''
+	the (minimum, maximum) of every column
+	'''
+	if isnumpy(rows):
+		if isinstance(rows, blogmatrix.csrmatrix):
+			mins, maxs = rows.columnranges()
+		else:
+			mins, maxs = rows.min(axis=0), rows.max(axis=0)
+		return list(zip(mins.tolist(), maxs.tolist()))
+	return [(min([row[i] for row in rows]), max([row[i] for row in rows])) for i in range(len(rows[0]))]
+
+
+def clustersums(rows, bestmatches):
+	'''
+	the sum of the rows of every cluster of bestmatches, column by column
+	'''
+	if isnumpy(rows):
+		k = len(bestmatches)
+		# the rows of no cluster are summed into an extra one
+		assigned = np.full(len(rows), k, dtype=int)
+		for j, matches in enumerate(bestmatches):
+			assigned[matches] = j
+		if isinstance(rows, blogmatrix.csrmatrix):
+			sums = rows.sumrows(assigned, k + 1)
+		else:
+			sums = np.zeros((k + 1, rows.shape[1]))
+			np.add.at(sums, assigned, rows)
+		return sums[:k].tolist()
+
+	sums = []
+	for matches in bestmatches:
+		total = [0.0] * len(rows[0])
+		for rowid in matches:
+			for m in range(len(rows[rowid])):
+				total[m] += rows[rowid][m]
+		sums.append(total)
+	return sums
+
+
+def randomcentroids(rows, k, rng):
+	'''
+	centroids placed uniformly between the minimum and maximum of every column
+	'''
+	ranges = columnranges(rows)
+	return [[rng.random() * (ranges[i][1] - ranges[i][0]) + ranges[i][0] for i in range(len(rows[0]))] for j in range(k)]
+
+
+def kmeansplusplus(rows, k, distance, matrixdistance, rng):
+	'''
+	k-means++ seeding: the first centroid is a random row, every next one is a row
+	picked with a probability proportional to its squared distance to the closest centroid so far
+	'''
+	clusters = [[float(x) for x in rows[rng.randrange(len(rows))]]]
+	closest = [max(d, 0) for d in nearestcentroids(rows, clusters, distance, matrixdistance)[1]]
+
+	while len(clusters) < k:
+		weights = [d * d for d in closest]
+		total = sum(weights)
+		if total == 0:
+			# every row sits on a centroid already
+			pick = rng.randrange(len(rows))
+		else:
+			target = rng.random() * total
+			pick = 0
+			while pick < len(rows) - 1 and target >= weights[pick]:
+				target -= weights[pick]
+				pick += 1
+		clusters.append([float(x) for x in rows[pick]])
+
+		newdistances = nearestcentroids(rows, clusters[-1:], distance, matrixdistance)[1]
+		closest = [min(closest[i], max(newdistances[i], 0)) for i in range(len(rows))]
+
+	return clusters
+
+
+def kcluster(rows, distance=pearson, k=4, init='random', batchsize=None, tol=0.0, maxiter=100, seed=None, workers=1):
 	'''
 	clistering using K-means
 	k is the number of clusters
@@ -198,29 +485,54 @@ def kcluster(rows, distance=pearson, k=4):
 	1. assigning rows to clusters
 	2. finding new cluster centroids: the mean of the assigned rows
 	3. assigning the clusters and the process repeats
+	when distance has a numpy version the distances of all the rows to all the
+	centroids are computed in one call per iteration
+	init -> 'random' places the centroids between the column ranges, 'kmeans++' spreads them over the rows
+	batchsize -> when set, every iteration moves the centroids towards a random sample of
+	that many rows instead of passing over all of them (mini-batch k-means)
+	tol -> also stop once no centroid moves further than tol (euclidean)
+	maxiter -> the most iterations, or batches
+	seed -> seeds a random generator of its own, the random module is used otherwise
+	workers -> assigns the rows on that many processes with parallelkmeans, the number
+	of cpus when None; distance has to be a function of a module then
 	'''
-	# the initial centroids will have their value between the maximum and minimum of
-	# the columns of the datasets
-	ranges = [(min([row[i] for row in rows]), max([row[i] for row in rows])) for i in range(len(rows[0]))]
+	if maxiter < 1:
+		raise ValueError('maxiter must be at least 1')
+
+	if workers != 1:
+		if batchsize is not None:
+			raise ValueError('batchsize runs on one process only')
+		import parallelkmeans
+		return parallelkmeans.kcluster(rows, distance, k, workers, init=init, tol=tol, maxiter=maxiter, seed=seed)
+
+	rng = random if seed is None else random.Random(seed)
+	matrixdistance = getmatrixdistance(distance)
+
+	if init == 'kmeans++':
+		clusters = kmeansplusplus(rows, k, distance, matrixdistance, rng)
+	elif init == 'random':
+		# the initial centroids will have their value between the maximum and minimum of
+		# the columns of the datasets
+		clusters = randomcentroids(rows, k, rng)
+	else:
+		raise ValueError("init must be 'random' or 'kmeans++'")
+
+	if batchsize is not None:
+		return minibatchkcluster(rows, clusters, distance, matrixdistance, batchsize, tol, maxiter, rng)
 
-	# randomly selected cluster centroids
-	clusters = [[random.random() * (ranges[i][1] - ranges[i][0]) + ranges[i][0] for i in range(len(rows[0]))] for j in range(k)]
+	if matrixdistance is not None:
+		data = distances.rowstats(rows)
 
-	# will iterate to 100 or up to the point that cluster assignment will not be changing
+	# will iterate to maxiter or up to the point that cluster assignment will not be changing
 	lastmatches = None
 
-	for iteration in range(100):
+	for iteration in range(maxiter):
 		print("Iteration {}".format(iteration))
 		bestmatches = [[] for j in range(k)]
 
 		# cluster assignment
-		for i in range(len(rows)):
-			bestmatch = 0
-
-			for j in range(k):
-				d = distance(rows[i], clusters[j])
-				if d < distance(rows[i], clusters[bestmatch]):
-					bestmatch = j
+		assigned = nearestcentroids(data if matrixdistance is not None else rows, clusters, distance, matrixdistance)[0]
+		for i, bestmatch in enumerate(assigned):
 			bestmatches[bestmatch].append(i)
 
 		# complete if cluster assignment is not changing
@@ -229,19 +541,128 @@ def kcluster(rows, distance=pearson, k=4):
 		lastmatches = bestmatches
 
 		# moving the centroids to be the mean of the data assigned to each class
+		shift = 0.0
+		sums = clustersums(rows, bestmatches)
 		for i in range(k):
-			avgs = [0.0] * len(rows[0])
+			avgs = sums[i]
 			if len(bestmatches[i]) > 0:
-				for rowid in bestmatches[i]:
-					for m in range(len(rows[rowid])):
-						avgs[m] += rows[rowid][m]
 				for j in range(len(avgs)):
 					avgs[j] /= len(bestmatches[i])
+				shift = max(shift, euclidean(clusters[i], avgs))
 				clusters[i] = avgs
 
+		if shift <= tol:
+			break
+
+	return bestmatches
+
+
+def minibatchkcluster(rows, clusters, distance, matrixdistance, batchsize, tol, maxiter, rng):
+	'''
+	mini-batch k-means: each centroid moves towards the sampled rows assigned to it
+	by 1 / (the number of rows it has been given so far), then all the rows are
+	assigned once at the end, batchsize rows at a time
+	stepping through the rows of a batch one by one ends on the running mean of
+	everything a centroid was given, so a batch is summed per cluster with clustersums
+	'''
+	k = len(clusters)
+	counts = [0] * k
+
+	for iteration in range(maxiter):
+		print("Iteration {}".format(iteration))
+		sampleids = [rng.randrange(len(rows)) for i in range(batchsize)]
+		if isnumpy(rows):
+			sample = rows.take(sampleids) if isinstance(rows, blogmatrix.csrmatrix) else rows[sampleids]
+		else:
+			sample = [rows[i] for i in sampleids]
+		batchmatches = [[] for j in range(k)]
+		for i, bestmatch in enumerate(nearestcentroids(sample, clusters, distance, matrixdistance)[0]):
+			batchmatches[bestmatch].append(i)
+
+		old = [list(c) for c in clusters]
+		sums = clustersums(sample, batchmatches)
+		for j in range(k):
+			given = len(batchmatches[j])
+			if given > 0:
+				counts[j] += given
+				kept = counts[j] - given
+				clusters[j] = [(kept * clusters[j][m] + sums[j][m]) / counts[j] for m in range(len(sums[j]))]
+
+		if max([euclidean(old[j], clusters[j]) for j in range(k)]) <= tol:
+			break
+
+	bestmatches = [[] for j in range(k)]
+	for start in range(0, len(rows), batchsize):
+		chunk = [rows[i] for i in range(start, min(start + batchsize, len(rows)))]
+		for i, bestmatch in enumerate(nearestcentroids(chunk, clusters, distance, matrixdistance)[0]):
+			bestmatches[bestmatch].append(start + i)
 	return bestmatches
 
 
+def clusterscore(rows, bestmatches, distance=pearson):
+	'''
+	the total distance of the rows to the mean of their cluster, lower is better
+	'''
+	matrixdistance = getmatrixdistance(distance)
+	centroids = [[x / float(max(len(matches), 1)) for x in sums]
+		for matches, sums in zip(bestmatches, clustersums(rows, bestmatches))]
+	if matrixdistance is not None:
+		# the distances of all the rows to all the centroids in one call, the rows aren't copied
+		d = matrixdistance(rows, centroids)
+	total = 0.0
+	for j, matches in enumerate(bestmatches):
+		if len(matches) == 0:
+			continue
+		if matrixdistance is not None:
+			total += float(d[matches, j].sum())
+		else:
+			total += sum([distance(rows[i], centroids[j]) for i in matches])
+	return total
+
+
+def kclusterseeds(rows, distance, k, seeds, options):
+	'''
+	runs kcluster once for every seed, in a worker for kcluster_restarts
+	returns (seed, score, seconds, bestmatches) for each run
+	'''
+	results = []
+	for seed in seeds:
+		start = time.time()
+		bestmatches = kcluster(rows, distance, k, seed=seed, **options)
+		score = clusterscore(rows, bestmatches, distance)
+		results.append((seed, score, time.time() - start, bestmatches))
+	return results
+
+
+def kcluster_restarts(rows, k=4, n_init=10, n_jobs=None, distance=pearson, seed=None, **options):
+	'''
+	runs kcluster n_init times from different seeds and keeps the run with the
+	lowest clusterscore, since a single run can end in a bad local optimum
+	n_jobs -> the number of processes, the number of cpus when None and no pool at all when 1
+	seed -> seeds the seeds of the runs, so the whole search can be repeated
+	options -> passed on to kcluster, e.g. init='kmeans++'
+	distance has to be a function of a module, so that the workers can unpickle it
+	returns the best clusters and the (seed, score, seconds) of every run
+	'''
+	rng = random if seed is None else random.Random(seed)
+	seeds = [rng.randrange(2 ** 31) for i in range(n_init)]
+
+	if n_jobs == 1 or ProcessPoolExecutor is None:
+		results = kclusterseeds(rows, distance, k, seeds, options)
+	else:
+		# every worker gets a share of the seeds, so the rows are sent once per worker
+		if n_jobs is None:
+			n_jobs = multiprocessing.cpu_count()
+		shares = [seeds[i::n_jobs] for i in range(min(n_jobs, len(seeds)))]
+		with ProcessPoolExecutor(max_workers=len(shares)) as executor:
+			futures = [executor.submit(kclusterseeds, rows, distance, k, share, options) for share in shares]
+			results = [result for future in futures for result in future.result()]
+		results.sort(key=lambda result: seeds.index(result[0]))
+
+	best = min(results, key=lambda result: result[1])
+	return best[3], [(seed, score, seconds) for seed, score, seconds, bestmatches in results]
+
+
 def tanimoto(v1, v2):
 	'''
 	gets the tanimoto coefficient of the 2 vectors
@@ -259,4 +680,4 @@ def tanimoto(v1, v2):
 		if v1[i] != 0 and v2[i] != 0:
 			shr += 1
 
-		return 1.0 - float(shr) / (c1 + c2 - shr)
\ No newline at end of file
+	return 1.0 - float(shr) / (c1 + c2 - shr)
\ No newline at end of file
@@ -0,0 +1,118 @@
+'''
+numpy versions of the distances in clusters.py
+instead of one pair of vectors at a time, every function returns the
+distances between all the rows of a and all the rows of b (or of a with
+itself) as a matrix. the sums, squared sums and non zero counts of the rows
+are computed once by rowstats, so the rows can be prepared once and compared
+against new centroids many times.
+the values are the same as pearson, tanimoto and euclidean in clusters.py up
+to rounding, as the sums are taken in another order.
+a blogmatrix.csrmatrix stays sparse, its products with the other rows are
+taken over the non zero entries only.
+'''
+import numpy as np
+
+from blogmatrix import csrmatrix
+
+
+class rowstats():
+	def __init__(self, rows):
+		'''
+		rows -> a list of equally long vectors, a 2d array or a csrmatrix
+		'''
+		if isinstance(rows, csrmatrix):
+			self.data = rows
+			entries = rows.rowids()
+			self.sums = np.bincount(entries, weights=rows.values, minlength=rows.shape[0])
+			self.sqsums = np.bincount(entries, weights=rows.values.astype(np.float64) ** 2, minlength=rows.shape[0])
+		else:
+			self.data = np.asarray(rows, dtype=np.float64)
+			if self.data.ndim == 1:
+				self.data = self.data[None, :]
+			self.sums = self.data.sum(axis=1)
+			self.sqsums = (self.data ** 2).sum(axis=1)
+		# only tanimoto needs them, they are made by nonzeros on first use
+		self.nonzero = None
+		self.counts = None
+
+	def nonzeros(self):
+		'''
+		a matrix with 1 where the rows are non zero, and the number of non zero columns of every row
+		'''
+		if self.nonzero is None:
+			if isinstance(self.data, csrmatrix):
+				ones = (self.data.values != 0).astype(np.float64)
+				self.nonzero = csrmatrix(self.data.indptr, self.data.indices, ones, self.data.shape)
+				self.counts = np.bincount(self.data.rowids(), weights=ones, minlength=self.data.shape[0])
+			else:
+				self.nonzero = (self.data != 0).astype(np.float64)
+				self.counts = self.nonzero.sum(axis=1)
+		return self.nonzero, self.counts
+
+
+def prepare(rows):
+	if isinstance(rows, rowstats):
+		return rows
+	return rowstats(rows)
+
+
+def products(a, b):
+	'''
+	the dot product of every row of a with every row of b, either can be a csrmatrix
+	'''
+	if isinstance(a, csrmatrix):
+		if isinstance(b, csrmatrix):
+			return a.dotrows(b)
+		return a.dot(b.T)
+	if isinstance(b, csrmatrix):
+		return b.dot(a.T).T
+	return a.dot(b.T)
+
+
+def pearsonmatrix(a, b=None):
+	'''
+	1 - the pearson correlation of every row of a with every row of b
+	a pair whose variance product is 0 gets 0 like clusters.pearson
+	'''
+	a = prepare(a)
+	b = a if b is None else prepare(b)
+	n = a.data.shape[1]
+
+	sumProd = products(a.data, b.data)
+	num = sumProd - np.outer(a.sums, b.sums) / n
+	denom = np.sqrt(np.abs(np.outer(a.sqsums - a.sums ** 2 / n, b.sqsums - b.sums ** 2 / n)))
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		result = 1.0 - num / denom
+	result[denom == 0] = 0
+	return result
+
+
+def tanimotomatrix(a, b=None):
+	'''
+	1 - the share of the non zero columns two rows have in common, for every row of a and b
+	two rows without any non zero column get 0
+	'''
+	a = prepare(a)
+	b = a if b is None else prepare(b)
+
+	anonzero, acounts = a.nonzeros()
+	bnonzero, bcounts = b.nonzeros()
+	shr = products(anonzero, bnonzero)
+	union = acounts[:, None] + bcounts[None, :] - shr
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		result = 1.0 - shr / union
+	result[union == 0] = 0
+	return result
+
+
+def euclideanmatrix(a, b=None):
+	'''
+	the euclidean distance between every row of a and every row of b
+	'''
+	a = prepare(a)
+	b = a if b is None else prepare(b)
+
+	squared = a.sqsums[:, None] + b.sqsums[None, :] - 2 * products(a.data, b.data)
+	return np.sqrt(np.maximum(squared, 0))
@@ -0,0 +1,206 @@
+'''
+downloads and parses many feeds at once for generatefeedvector.py
+the feeds are fetched on a pool of threads, so a slow feed only holds up its
+own thread. every request has a timeout and failed requests are tried again
+after a growing pause. with a cache directory the body of every feed is saved
+with its ETag and Last-Modified headers, and the next fetch asks the server
+for the feed only if it changed (a 304 reply reuses the saved body).
+a source can also be a path to a saved feed, and fetchdirectory parses every
+saved feed of a directory, so the whole pipeline runs without the network.
+iterfeeds hands out the feeds as they are finished instead of all at the end.
+usage: python feedfetcher.py feedlist.txt --workers 16 --cache feedcache
+'''
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+import feedparser
+
+try:
+	from http.client import IncompleteRead
+	from urllib.error import HTTPError, URLError
+	from urllib.request import Request, urlopen
+except ImportError:  # python 2
+	from httplib import IncompleteRead
+	from urllib2 import HTTPError, Request, URLError, urlopen
+
+try:
+	CONNECTION_ERRORS = (ConnectionError,)
+except NameError:  # python 2, where a reset connection is a plain socket.error
+	CONNECTION_ERRORS = (socket.error,)
+
+# statuses worth trying again, the other http errors fail straight away
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+# the errors of a download worth trying again, also raised while the body is read
+RETRY_ERRORS = (URLError, socket.timeout, IncompleteRead) + CONNECTION_ERRORS
+
+
+def cachepaths(cachedir, url):
+	'''
+	the files of the saved body and headers of url, a byte string url is hashed as it is
+	'''
+	key = hashlib.sha1(url if isinstance(url, bytes) else url.encode('utf-8')).hexdigest()
+	return os.path.join(cachedir, key + '.xml'), os.path.join(cachedir, key + '.json')
+
+
+def download(url, timeout, cachedir=None):
+	'''
+	the body of the feed at url, a conditional request when it is in the cache
+	'''
+	headers = {'User-Agent': 'generatefeedvector'}
+	body_path = meta_path = None
+	meta = {}
+	if cachedir is not None:
+		body_path, meta_path = cachepaths(cachedir, url)
+		if os.path.exists(meta_path) and os.path.exists(body_path):
+			with open(meta_path) as f:
+				meta = json.load(f)
+			if meta.get('etag'):
+				headers['If-None-Match'] = meta['etag']
+			if meta.get('modified'):
+				headers['If-Modified-Since'] = meta['modified']
+
+	try:
+		response = urlopen(Request(url, headers=headers), timeout=timeout)
+	except HTTPError as e:
+		# only a conditional request, made with a saved body, can get a 304
+		if e.code == 304 and body_path is not None and os.path.exists(body_path):
+			with open(body_path, 'rb') as f:
+				return f.read()
+		raise
+
+	try:
+		body = response.read()
+		info = response.info()
+	finally:
+		response.close()
+
+	if cachedir is not None:
+		with open(body_path, 'wb') as f:
+			f.write(body)
+		with open(meta_path, 'w') as f:
+			json.dump({'url': url, 'etag': info.get('ETag'), 'modified': info.get('Last-Modified')}, f)
+	return body
+
+
+def fetchfeed(source, timeout=10, retries=2, backoff=1.0, cachedir=None):
+	'''
+	the parsed feed of source, an url or the path of a saved feed
+	a download that timed out, couldn't connect, was cut off or got one of RETRY_STATUSES
+	is tried retries more times, waiting backoff, 2 * backoff, ... seconds in between
+	'''
+	if os.path.exists(source):
+		with open(source, 'rb') as f:
+			return feedparser.parse(f.read())
+
+	attempt = 0
+	while True:
+		try:
+			return feedparser.parse(download(source, timeout, cachedir))
+		except RETRY_ERRORS as e:
+			# an HTTPError is an URLError too
+			if attempt >= retries or (isinstance(e, HTTPError) and e.code not in RETRY_STATUSES):
+				raise
+			time.sleep(backoff * pow(2, attempt))
+			attempt += 1
+
+
+def iterfeeds(sources, workers=8, timeout=10, retries=2, backoff=1.0, cachedir=None):
+	'''
+	fetches and parses the sources on workers threads and yields (source, parsed feed, error)
+	as every feed is finished, error is None for the feeds that worked
+	only twice as many feeds as workers are fetched ahead, so the parsed feeds don't
+	pile up when the caller takes longer over them than the network
+	'''
+	if cachedir is not None and not os.path.isdir(cachedir):
+		os.makedirs(cachedir)
+
+	sources = iter(sources)
+	pending = {}
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		while True:
+			for source in islice(sources, 2 * workers - len(pending)):
+				pending[executor.submit(fetchfeed, source, timeout, retries, backoff, cachedir)] = source
+			if not pending:
+				return
+			done = wait(pending, return_when=FIRST_COMPLETED)[0]
+			for future in done:
+				source = pending.pop(future)
+				try:
+					yield source, future.result(), None
+				except Exception as e:
+					yield source, None, e
+
+
+def fetchfeeds(sources, workers=8, timeout=10, retries=2, backoff=1.0, cachedir=None, progress=None):
+	'''
+	fetches and parses all the sources on workers threads
+	returns the parsed feeds and the errors, both keyed by source
+	progress -> called as progress(done, total) whenever a feed is finished
+	'''
+	sources = list(sources)
+	feeds = {}
+	errors = {}
+	for source, feed, error in iterfeeds(sources, workers, timeout, retries, backoff, cachedir):
+		if error is None:
+			feeds[source] = feed
+		else:
+			errors[source] = error
+		if progress is not None:
+			progress(len(feeds) + len(errors), len(sources))
+	return feeds, errors
+
+
+def readfeedlist(filename):
+	'''
+	the urls of a feedlist.txt file, one per line
+	'''
+	with open(filename) as f:
+		return [line.strip() for line in f if line.strip()]
+
+
+def directorysources(directory):
+	'''
+	the saved feeds of directory, the cache of fetchfeeds included
+	'''
+	return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+		if name.endswith('.xml') or name.endswith('.rss') or name.endswith('.atom'))
+
+
+def fetchdirectory(directory, workers=8):
+	'''
+	parses every saved feed in directory, the cache of fetchfeeds included
+	'''
+	return fetchfeeds(directorysources(directory), workers)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='fetches and parses feeds concurrently')
+	parser.add_argument('source', help='a feedlist.txt file or a directory of saved feeds')
+	parser.add_argument('--workers', type=int, default=8)
+	parser.add_argument('--timeout', type=float, default=10, help='seconds per request')
+	parser.add_argument('--retries', type=int, default=2)
+	parser.add_argument('--cache', help='directory for the conditional GET cache')
+	args = parser.parse_args(argv)
+
+	start = time.time()
+	if os.path.isdir(args.source):
+		feeds, errors = fetchdirectory(args.source, args.workers)
+	else:
+		feeds, errors = fetchfeeds(readfeedlist(args.source), args.workers, args.timeout, args.retries,
+			cachedir=args.cache)
+	elapsed = time.time() - start
+
+	for source, error in sorted(errors.items()):
+		sys.stderr.write('{}: {}\n'.format(source, error))
+	print('{} feeds, {} errors in {:.2f} seconds'.format(len(feeds), len(errors), elapsed))
+
+
+if __name__ == '__main__':
+	main()
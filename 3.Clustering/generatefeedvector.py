@@ -1,69 +1,227 @@
-import feedparser
+'''
+builds blogdata.txt, the word counts of the blogs clustered by clusters.py
+the feeds are fetched by feedfetcher and every feed is tokenized as soon as it
+arrives, then dropped: a blog only keeps the ids of its words (numbered by one
+vocabulary dict) and their counts, in two compact arrays. the number of blogs
+using every word is kept in the same pass, so the vocabulary is chosen without
+going over the counts again.
+with hashing the words are folded into a fixed number of columns by a hash
+of the word, so no vocabulary is chosen at all and the counts of a blog can be
+reduced as soon as it is read. an output ending in .npz gets the sparse matrix
+in blogmatrix.savenpz format instead of the text file, clusters.readfile reads both.
+usage: python generatefeedvector.py --feedlist data/feedlist.txt --output data/blogdata.txt
+	python generatefeedvector.py --hash 4096 --output data/blogdata.npz
+'''
+import argparse
+import codecs
+import os
 import re
+import zlib
+from array import array
+
+import feedparser
+
+import feedfetcher
+
+try:
+	import blogmatrix
+except ImportError:  # numpy is not installed, only the text output is available
+	blogmatrix = None
+
+# html tags, and the runs of letters making the words
+TAGS = re.compile(r'<[^>]+>')
+WORD = re.compile(r'[A-Za-z]+')
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 
-def getwordcounts(url):
+
+def iterwords(html):
+	'''
+	removes html tags and yields the lowercase words, split on non-alpha characters
+	'''
+	for match in WORD.finditer(TAGS.sub('', html)):
+		yield match.group().lower()
+
+
+def getwords(html):
+	'''
+	removes html tags and splits the words using non-alpha characters
+	'''
+	return list(iterwords(html))
+
+
+def getwordcounts(url, d=None):
 	'''
 	gets the title and word counts in a blog
+	d -> the feed already parsed, e.g. by feedfetcher, otherwise url is fetched
 	'''
 	wc = {}
 
-	d = feedparser.parse(url)
+	if d is None:
+		d = feedparser.parse(url)
 
 	for e in d.entries:
 		if 'summary' in e:
 			summary = e.summary
 		else:
-			summary = e.description
+			summary = e.get('description', '')
 
-		words = getwords(e.title + summary)
-		for word in words:
-			wc.setdefault(word, 0)
-			wc[word] += 1
-	return d.feed.title, wc
+		for word in iterwords(e.get('title', '') + ' ' + summary):
+			wc[word] = wc.get(word, 0) + 1
+	return d.feed.get('title', url), wc
 
-def getwords(html):
+
+def hashcolumn(word, nfeatures):
 	'''
-	removes html tags and splits the words using non-alpha characters
+	the column of word among nfeatures hashed columns, the same on every run and python version
 	'''
+	return 'hash%d' % hashid(word, nfeatures)
 
-	txt = re.compile(r'<[^>]+>').sub('', html)
 
-	words = re.compile(r'[^A-Z^a-z]+').split(txt)
+def hashid(word, nfeatures):
+	'''
+	the number of the hashed column of word
+	'''
+	return (zlib.crc32(word.encode('utf-8')) & 0xffffffff) % nfeatures
 
-	return [word.lower() for word in words if word != ' ']
 
+def countwords(feeds, nfeatures=None):
+	'''
+	feeds -> (url, parsed feed) pairs, e.g. from feedfetcher.iterfeeds
+	every feed is tokenized as it comes and only its counts are kept, as arrays of
+	word ids and counts, so neither the parsed feeds nor a dict per blog pile up
+	returns the (url, title, word ids, counts) of every blog, the words by id and,
+	for every word id, the number of blogs using it more than once
+	nfeatures -> count the hashed columns instead of the words, the ids are the
+	columns then and there are no blog counts
+	'''
+	blogs = []
+	words = []
+	wordids = {}
+	apcount = array('i')
+	for url, d in feeds:
+		title, wc = getwordcounts(url, d)
+		counts = {}
+		for word, count in wc.items():
+			if nfeatures is not None:
+				wordid = hashid(word, nfeatures)
+			else:
+				wordid = wordids.get(word)
+				if wordid is None:
+					wordid = wordids[word] = len(words)
+					words.append(word)
+					apcount.append(0)
+				if count > 1:
+					apcount[wordid] += 1
+			counts[wordid] = counts.get(wordid, 0) + count
+		ids = sorted(counts)
+		blogs.append((url, title, array('i', ids), array('i', [counts[wordid] for wordid in ids])))
+	return blogs, words, apcount
 
-apcount = {}
-wordcount = {}
 
-path = '/home/mirikwa/projects/ml/Programming-Collective-Intelligence/3.Clustering/data'
+def selectwords(apcount, nblogs, lower=0.1, upper=0.5):
+	'''
+	the words used by more than lower and less than upper of the blogs, in alphabetical order
+	dropping words that are too common or very strange and thus appear in very few blogs
+	'''
+	return sorted(word for word, count in apcount.items() if lower < float(count) / nblogs < upper)
+
+
+def keptcounts(blogs, columns):
+	'''
+	the (title, word counts) of every blog of countwords, for the word ids in columns
+	columns -> word id -> the name of its column
+	'''
+	for url, title, ids, counts in blogs:
+		yield title, dict((columns[wordid], count) for wordid, count in zip(ids, counts) if wordid in columns)
+
+
+def writematrix(out, blogs, wordlist):
+	'''
+	writes the tab separated matrix read by clusters.readfile: a row of the words,
+	then the title and the counts of every blog
+	'''
+	out.write('Blog')
+	for word in wordlist:
+		out.write('\t%s' % word)
+	out.write('\n')
+
+	for title, wc in blogs:
+		out.write(title.replace('\t', ' ').replace('\n', ' '))
+		for word in wordlist:
+			out.write('\t%d' % wc.get(word, 0))
+		out.write('\n')
+
 
-for feedurl in file(path + '/feedlist.txt'):
-	title, wc = getwordcounts(feedurl)
-	wordcount[title] = wc
-	for word, count in wc.items():
-		apcount.setdefault(word, 0)
-		if count <= 1:
-			continue
-		apcount[word] += 1
+def generate(feedlist, output, cachedir=None, workers=8, lower=0.1, upper=0.5, nfeatures=None):
+	'''
+	fetches the feeds of feedlist and writes the matrix of their word counts to output
+	feedlist can also be a directory of saved feeds
+	nfeatures -> the number of hashed columns, the words are kept as columns when None
+	output -> the text file, or a .npz file for the sparse matrix
+	the feeds are counted as they are fetched, only their counts are kept
+	returns the titles of the blogs and the words (or hashed columns) kept
+	'''
+	if output.endswith('.npz') and blogmatrix is None:
+		raise ImportError('the .npz output needs numpy')
+
+	if os.path.isdir(feedlist):
+		sources = feedfetcher.directorysources(feedlist)
+		cachedir = None
+	else:
+		sources = feedfetcher.readfeedlist(feedlist)
+
+	errors = {}
+
+	def fetched():
+		for source, d, error in feedfetcher.iterfeeds(sources, workers, cachedir=cachedir):
+			if error is None:
+				yield source, d
+			else:
+				errors[source] = error
 
+	blogs, words, apcount = countwords(fetched(), nfeatures)
+	for source in sorted(errors):
+		print('Failed to parse feed %s: %s' % (source, errors[source]))
+	# the rows in the order of the feed list, whatever order the feeds came in
+	position = dict((source, i) for i, source in enumerate(sources))
+	blogs.sort(key=lambda blog: position[blog[0]])
 
-# gettingn the wors that will actually be used in clustering
-# dropping words that are too common or very strange and thus appear in very few blogs
-wordlist = []
-feedlist = open(path + '/feedlist.txt').readlines()
-for word, count in apcount.items():
-	frac = float(count) / len(feedlist)
-	if frac > 0.1 and frac < 0.5:
-		wordlist.append(word)
+	if nfeatures is not None:
+		wordlist = ['hash%d' % i for i in range(nfeatures)]
+		columns = dict((i, wordlist[i]) for i in range(nfeatures))
+	else:
+		wordlist = selectwords(dict(zip(words, apcount)), len(sources), lower, upper)
+		kept = set(wordlist)
+		columns = dict((wordid, word) for wordid, word in enumerate(words) if word in kept)
 
-out = file(path + '/blogdata.txt', 'w')
-out.write('Blog')
-for word in wordlist:
-	out.write('\t{}'.format(word))
-for word, count in wordcount.items():
-	if word in wordlist:
-		out.write('\t{}'.format(count))
+	titles = [title for url, title, ids, counts in blogs]
+	if output.endswith('.npz'):
+		blogmatrix.savenpz(output, titles, wordlist, blogmatrix.fromcounts((wc for title, wc in keptcounts(blogs, columns)),
+			wordlist))
 	else:
-		out.write('\t0')
-	out.write('\n')
\ No newline at end of file
+		with codecs.open(output, 'w', 'utf-8') as out:
+			writematrix(out, keptcounts(blogs, columns), wordlist)
+	return titles, wordlist
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='writes the word counts of blogs for clusters.py')
+	parser.add_argument('--feedlist', default=os.path.join(DATA, 'feedlist.txt'),
+		help='file of feed urls, one per line, or a directory of saved feeds')
+	parser.add_argument('--output', default=os.path.join(DATA, 'blogdata.txt'),
+		help='the text file, or a .npz file for the sparse matrix')
+	parser.add_argument('--cache', default=os.path.join(DATA, 'feedcache'), help='directory for the fetched feeds')
+	parser.add_argument('--workers', type=int, default=8)
+	parser.add_argument('--lower', type=float, default=0.1, help='least share of blogs using a kept word')
+	parser.add_argument('--upper', type=float, default=0.5, help='largest share of blogs using a kept word')
+	parser.add_argument('--hash', type=int, help='fold the words into this many hashed columns')
+	args = parser.parse_args(argv)
+
+	titles, wordlist = generate(args.feedlist, args.output, args.cache, args.workers, args.lower, args.upper,
+		args.hash)
+	print('%d blogs, %d words' % (len(titles), len(wordlist)))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,126 @@
+'''
+k-means like clusters.kcluster with the assignment step on a pool of processes,
+clusters.kcluster(rows, workers=...) runs it
+the rows are written once by blogmatrix.save into a temporary directory and
+every worker memory maps them read only, so the pages are shared between the
+processes and only the centroids travel to the workers on each iteration.
+a blogmatrix.csrmatrix stays sparse: its indptr, indices and values arrays are
+mapped and every shard is a slice of them, other rows are saved as a dense array.
+the rows are split into shards, one task per shard and iteration; a task
+assigns the rows of its shard and returns the sums and counts of the rows per
+cluster, which are added up into the new centroids.
+'''
+import os
+import random
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import blogmatrix
+import distances
+from clusters import getmatrixdistance, kmeansplusplus, nearestcentroids, pearson, randomcentroids
+
+# the rows already mapped by this process, keyed by their directory
+mapped_rows = {}
+
+
+def assignShard(path, start, end, clusters, distance):
+	'''
+	runs in a worker, assigns the rows start to end to their closest centroids
+	returns the assignments and the sums and counts of the rows given to each centroid
+	'''
+	if path not in mapped_rows:
+		mapped_rows[path] = blogmatrix.load(path)[2]
+	shard = mapped_rows[path][start:end]
+
+	matrixdistance = getmatrixdistance(distance)
+	if matrixdistance is not None:
+		# prepared again on every task, any worker can get any shard so a cache would end up holding them all
+		assigned = np.asarray(nearestcentroids(distances.rowstats(shard), clusters, distance, matrixdistance)[0])
+	else:
+		assigned = np.asarray(nearestcentroids(list(shard), clusters, distance, None)[0])
+
+	counts = np.bincount(assigned, minlength=len(clusters)).astype(np.float64)
+	if isinstance(shard, blogmatrix.csrmatrix):
+		return assigned, shard.sumrows(assigned, len(clusters)), counts
+	onehot = np.zeros((len(clusters), end - start))
+	onehot[assigned, np.arange(end - start)] = 1
+	return assigned, onehot.dot(shard), counts
+
+
+def kcluster(rows, distance=pearson, k=4, workers=None, shardsize=65536, init='random', tol=0.0, maxiter=100, seed=None):
+	'''
+	the same clusters as clusters.kcluster
+	workers -> the number of processes, the number of cpus when None and no pool at all when 1
+	shardsize -> the number of rows assigned by one task
+	init, tol, maxiter and seed are the options of clusters.kcluster
+	distance has to be a function of a module, so that the workers can unpickle it
+	'''
+	if maxiter < 1:
+		raise ValueError('maxiter must be at least 1')
+	rng = random if seed is None else random.Random(seed)
+	if isinstance(rows, (blogmatrix.csrmatrix, np.ndarray)):
+		data = rows
+	else:
+		data = np.asarray(rows, dtype=np.float64)
+	total = len(data)
+
+	if init == 'kmeans++':
+		clusters = kmeansplusplus(data, k, distance, getmatrixdistance(distance), rng)
+	elif init == 'random':
+		clusters = randomcentroids(data, k, rng)
+	else:
+		raise ValueError("init must be 'random' or 'kmeans++'")
+	clusters = np.array(clusters, dtype=np.float64)
+
+	shards = [(start, min(start + shardsize, total)) for start in range(0, total, shardsize)]
+
+	if workers == 1:
+		path = None
+		mapped_rows[None] = data
+		executor = None
+	else:
+		path = tempfile.mkdtemp(prefix='kcluster')
+		blogmatrix.save(path, None, None, data)
+		del data
+		executor = ProcessPoolExecutor(max_workers=workers)
+
+	try:
+		lastassigned = None
+		for iteration in range(maxiter):
+			print("Iteration {}".format(iteration))
+			if executor is None:
+				results = [assignShard(path, start, end, clusters, distance) for start, end in shards]
+			else:
+				futures = [executor.submit(assignShard, path, start, end, clusters, distance) for start, end in shards]
+				results = [future.result() for future in futures]
+
+			assigned = np.concatenate([result[0] for result in results])
+			# complete if cluster assignment is not changing
+			if lastassigned is not None and (assigned == lastassigned).all():
+				break
+			lastassigned = assigned
+
+			# moving the centroids to be the mean of the rows assigned to them, empty clusters stay
+			sums = sum([result[1] for result in results])
+			counts = sum([result[2] for result in results])
+			filled = counts > 0
+			moved = sums[filled] / counts[filled][:, None]
+			shift = np.sqrt(((moved - clusters[filled]) ** 2).sum(axis=1)).max() if filled.any() else 0.0
+			clusters[filled] = moved
+
+			if shift <= tol:
+				break
+	finally:
+		if executor is None:
+			del mapped_rows[None]
+		else:
+			executor.shutdown()
+			shutil.rmtree(path, ignore_errors=True)
+
+	bestmatches = [[] for j in range(k)]
+	for i, bestmatch in enumerate(assigned):
+		bestmatches[bestmatch].append(i)
+	return bestmatches